@@ -0,0 +1,69 @@
+# compares find and get over 10k versions of one package using compiled
+# constraints and cached version keys against plain semver calls
+#
+#   python bench/constraints.py
+
+import os
+import sys
+import timeit
+import warnings
+import functools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import semver
+
+from sputnik import util
+from sputnik.package_list import PackageList
+from sputnik.package_stub import PackageStub
+
+
+class StubList(PackageList):
+    def packages(self, refresh=None):
+        for i in range(100):
+            for j in range(100):
+                package = PackageStub({'name': 'model', 'version': '%d.%d.0' % (i, j)})
+                package.path = 'model-%d.%d.0' % (i, j)
+                yield package
+
+
+# previous implementation, semver parses versions on every call
+def find_semver(packages, constraint):
+    constraints = [c.strip() for c in constraint.split(',') if c.strip()]
+    return [p for p in packages if all(semver.match(p.version, c) for c in constraints)]
+
+
+def get_semver(packages, constraint):
+    candidates = find_semver(packages, constraint)
+    return sorted(candidates, key=functools.cmp_to_key(
+        lambda a, b: semver.compare(a.version, b.version)))[-1]
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1000
+
+
+def main():
+    warnings.simplefilter('ignore')
+    package_list = StubList.__new__(StubList)
+    package_list.load()
+    packages = list(package_list._packages.values())
+    constraint = '>=20.0.0,<80.0.0'
+
+    rows = [
+        ('find', lambda: find_semver(packages, constraint),
+                 lambda: package_list.find('model' + constraint)),
+        ('get', lambda: get_semver(packages, constraint),
+                lambda: package_list.resolve('model' + constraint)),
+        ('match', lambda: find_semver(packages, constraint),
+                  lambda: [p for p in packages if util.constraint_match(constraint, p.version)]),
+    ]
+    for name, before, after in rows:
+        t_before = measure(before, 3)
+        t_after = measure(after, 10)
+        sys.stdout.write('%-6s 10k versions  semver %8.2f ms  now %8.3f ms  (%.0fx)\n' %
+                         (name, t_before, t_after, t_before / t_after))
+
+
+if __name__ == '__main__':
+    main()
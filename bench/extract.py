@@ -0,0 +1,95 @@
+# compares extraction throughput of the large-I/O path against the
+# previous fixed 16 KiB chunk path
+#
+#   python bench/extract.py [size in MiB]
+
+import os
+import io
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sputnik import default
+from sputnik import compression
+from sputnik.archive_writer import ArchiveWriter
+from sputnik.archive_reader import ArchiveReader
+
+
+class Legacy(object):
+    # patches out buffer scaling, buffer reuse, preallocation and
+    # in-kernel copies
+
+    def __enter__(self):
+        self.saved = [(default, 'MAX_BUFFER_SIZE', default.MAX_BUFFER_SIZE)]
+        for name in ['copy_file_range', 'sendfile', 'posix_fallocate']:
+            if hasattr(os, name):
+                self.saved.append((os, name, getattr(os, name)))
+                delattr(os, name)
+        default.MAX_BUFFER_SIZE = default.CHUNK_SIZE
+
+        iter_read = compression.iter_read
+        self.saved.append((compression, 'iter_read', iter_read))
+        compression.iter_read = lambda f, length, chunk_size, reuse=True: \
+            iter_read(f, length, chunk_size, reuse=False)
+
+    def __exit__(self, *args):
+        for obj, name, value in self.saved:
+            setattr(obj, name, value)
+
+
+def build(path, size, codec):
+    base_path = os.path.join(path, codec)
+    filename = os.path.join(base_path, 'data.bin')
+    os.makedirs(base_path)
+
+    # half random, half compressible
+    with io.open(filename, 'wb') as f:
+        for _ in range(size):
+            f.write(os.urandom(512 * 1024))
+            f.write(b'sputnik ' * (64 * 1024))
+
+    archive_path = os.path.join(path, codec + '.sputnik')
+    writer = ArchiveWriter(archive_path, base_path=base_path, codec=codec,
+                           compresslevel=1)
+    writer.add(filename)
+    writer.close()
+    return archive_path
+
+
+def measure(archive_path, extract_path, runs=3):
+    best = None
+    for _ in range(runs):
+        shutil.rmtree(extract_path, ignore_errors=True)
+        start = time.time()
+        with ArchiveReader(archive_path) as archive:
+            archive.extract_all(extract_path)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    path = tempfile.mkdtemp()
+    try:
+        for codec in ['stored', 'gzip']:
+            archive_path = build(path, size, codec)
+            extract_path = os.path.join(path, 'extract')
+
+            with Legacy():
+                before = measure(archive_path, extract_path)
+            after = measure(archive_path, extract_path)
+
+            sys.stdout.write('%-6s %4d MiB  16 KiB chunks %7.1f MiB/s  '
+                             'large I/O %7.1f MiB/s  (%.2fx)\n' %
+                             (codec, size, size / before, size / after,
+                              before / after))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 
 from . import default
 from .pool import Pool
@@ -17,19 +18,37 @@ def install(app_name,
             app_version,
             package_name,
             data_path=None,
-            repository_url=None):
+            repository_url=None,
+            workers=None,
+            pipelined=None,
+            dedup=None,
+            delta=None,
+            lazy=None):
 
     if data_path is None:
         data_path = default_data_path(app_name)
     if repository_url is None:
         repository_url = default.repository_url
+    if pipelined is None:
+        pipelined = default.install_pipelined
+    if dedup is None:
+        dedup = default.pool_dedup
+    if delta is None:
+        delta = default.install_delta
+    if lazy is None:
+        lazy = default.install_lazy
 
     package_name = expand_path(package_name)
     data_path = expand_path(data_path)
 
-    pool = Pool(app_name, app_version, data_path)
+    pool = Pool(app_name, app_version, data_path, dedup=dedup)
 
-    if os.path.isfile(package_name):
+    if package_name == '-':
+        # read archive from stdin in a single pass
+        archive = Archive(package_name,
+                          fileobj=getattr(sys.stdin, 'buffer', sys.stdin))
+
+    elif os.path.isfile(package_name):
         archive = Archive(package_name)
 
     else:
@@ -41,20 +60,28 @@ def install(app_name,
             return packages[0]
 
         cache = Cache(app_name, app_version, data_path)
-        archive = cache.fetch(package_name)
+        # lazy installs extract from the cached archive later on
+        archive = cache.fetch(package_name, pipelined=pipelined and not lazy,
+                              delta=delta)
 
-    path = pool.install(archive)
+    path = pool.install(archive, workers=workers, lazy=lazy)
     return Package(path=path)
 
 
 def build(package_path=None,
-          archive_path=None):
+          archive_path=None,
+          workers=None,
+          threads=None,
+          previous=None):
 
     if package_path is None:
         package_path = default.build_package_path
 
     recipe = Recipe(expand_path(package_path))
-    return recipe.build(expand_path(archive_path or package_path))
+    return recipe.build(expand_path(archive_path or package_path),
+                        workers=workers,
+                        threads=threads,
+                        previous=expand_path(previous))
 
 
 def remove(app_name,
@@ -156,7 +183,7 @@ def package(app_name,
     if data_path is None:
         data_path = default_data_path(app_name)
 
-    pool = Pool(app_name, app_version, expand_path(data_path))
+    pool = Pool.cached(app_name, app_version, expand_path(data_path))
     return pool.get(package_string)
 
 
@@ -180,6 +207,26 @@ def files(app_name,
     return res
 
 
+def verify(app_name,
+           app_version,
+           package_string=None,
+           fast=None,
+           workers=None,
+           data_path=None):
+
+    if package_string is None:
+        package_string = default.find_package_string
+    if fast is None:
+        fast = default.verify_fast
+    if data_path is None:
+        data_path = default_data_path(app_name)
+
+    pool = Pool(app_name, app_version, expand_path(data_path))
+    res = pool.verify(package_string, workers=workers, fast=fast)
+    json_print(res)
+    return res
+
+
 def purge(app_name,
           app_version,
           cache=None,
@@ -195,8 +242,9 @@ def purge(app_name,
 
     data_path = expand_path(data_path)
 
-    if cache or not cache and not pool:
-        Cache(app_name, app_version, data_path).purge()
-
+    # lazy installs keep their cached archives
     if pool or not cache and not pool:
         Pool(app_name, app_version, data_path).purge()
+
+    if cache or not cache and not pool:
+        Cache(app_name, app_version, data_path).purge()
@@ -4,12 +4,17 @@ import io
 from . import util
 from . import default
 from .package_stub import PackageStub
-from .archive_reader import ArchiveReader
+from .archive_reader import ArchiveReader, StreamArchiveReader
 
 
 class Archive(PackageStub):
-    def __init__(self, path):
-        self.archive = ArchiveReader(path)
+    def __init__(self, path, fileobj=None, reader=None):
+        if reader is not None:
+            self.archive = reader
+        elif fileobj is not None:
+            self.archive = StreamArchiveReader(fileobj, path)
+        else:
+            self.archive = ArchiveReader(path)
         defaults = self.archive.get_member('package')
         super(Archive, self).__init__(defaults)
 
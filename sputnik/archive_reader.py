@@ -1,14 +1,168 @@
-import gzip
 import io
 import os
-import hashlib
 import json
 import tarfile
 import codecs
 import shutil
+import tempfile
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
 
 from . import default
 from . import util
+from .compression import iter_decompress
+
+
+class MemberNotFoundException(Exception): pass
+
+
+# path parts, byte range of the member within archive.gz, uncompressed
+# size, (algorithm, hexdigest) checksum and codec of a file; files split
+# into independently compressed blocks of block_size bytes list their
+# blocks as (start, end, hexdigest), otherwise blocks is None
+MemberInfo = collections.namedtuple('MemberInfo',
+    ['path', 'start', 'end', 'size', 'checksum', 'codec', 'block_size', 'blocks'])
+
+
+def load_members(manifest):
+    members = []
+    noffset = 0
+    for entry in manifest:
+        blocks = None
+        if entry.get('blocks'):
+            blocks = []
+            block_start = noffset
+            for block_end, block_checksum in entry['blocks']:
+                blocks.append((block_start, block_end, block_checksum))
+                block_start = block_end
+
+        members.append(MemberInfo(
+            path=tuple(entry['path']),
+            start=noffset,
+            end=entry['noffset'],
+            size=entry['size'],
+            checksum=tuple(entry['checksum']),
+            codec=entry.get('codec', 'gzip'),
+            block_size=entry.get('block_size'),
+            blocks=blocks))
+        noffset = entry['noffset']
+    return members
+
+
+# yields decompressed chunks of the member at the current position of fileobj
+def iter_member(fileobj, info, chunk_size=None):
+    if not info.blocks:
+        return iter_decompress(fileobj, info.end - info.start, info.codec,
+                               chunk_size=chunk_size)
+    return iter_blocks(fileobj, info, info.blocks, chunk_size=chunk_size)
+
+
+def iter_blocks(fileobj, info, blocks, chunk_size=None):
+    for start, end, _ in blocks:
+        for chunk in iter_decompress(fileobj, end - start, info.codec,
+                                     chunk_size=chunk_size):
+            yield chunk
+
+
+# skips the member at the current position of fileobj without inflating it
+def skip_member(fileobj, info):
+    length = info.end - info.start
+    while length > 0:
+        data = fileobj.read(min(length, default.CHUNK_SIZE))
+        if not data:
+            raise Exception('unexpected end of archive')
+        length -= len(data)
+
+
+# extracts a single block of a member into an existing file, blocks
+# carry checksums of their own so they can be verified independently
+def extract_block(fileobj, info, index, filename, cb=None):
+    start, end, block_checksum = info.blocks[index]
+    checksum = util.new_checksum(info.checksum[0])
+
+    with io.open(filename, 'r+b') as f:
+        f.seek(index * info.block_size)
+        for chunk in iter_decompress(fileobj, end - start, info.codec,
+                                     chunk_size=util.buffer_size(info.block_size)):
+            f.write(chunk)
+            checksum.update(chunk)
+
+            # callback for progress tracking
+            if cb:
+                cb(len(chunk))
+
+    if checksum.hexdigest() != block_checksum:
+        raise Exception('checksum mismatch: %s (block %d)' % (filename, index))
+
+
+# extracts the member at the current position of fileobj
+def extract_member(fileobj, info, extract_path, cb=None, filename=None):
+    path = os.path.sep.join(info.path)
+    checksum = util.new_checksum(info.checksum[0])
+
+    if filename is None:
+        filename = os.path.join(extract_path, path)
+    util.makedirs(filename)
+    with io.open(filename, 'wb') as f:
+        util.preallocate(f, info.size)
+
+        bytes_read = 0
+        for chunk in iter_member(fileobj, info, util.buffer_size(info.size)):
+            bytes_read += len(chunk)
+
+            f.write(chunk)
+            checksum.update(chunk)
+
+            # callback for progress tracking
+            if cb:
+                cb(bytes_read)
+
+    # checksums from bytes read and meta data should match
+    if checksum.hexdigest() != info.checksum[1]:
+        raise Exception('checksum mismatch: %s' % path)
+
+
+# extracts a stored member by copying its byte range within the kernel,
+# the checksum is computed from the written file
+def extract_stored(archive, offset, info, filename, cb=None):
+    util.makedirs(filename)
+    with io.open(filename, 'wb', buffering=0) as f:
+        util.preallocate(f, info.size)
+        util.copy_range(archive, offset + info.start, f, info.size, cb=cb)
+
+    checksum = util.file_checksum(filename, info.checksum[0],
+                                  util.buffer_size(info.size))
+    if checksum != info.checksum[1]:
+        raise Exception('checksum mismatch: %s' % os.path.sep.join(info.path))
+
+
+class MemberFile(io.RawIOBase):
+    def __init__(self, fileobj, chunks):
+        super(MemberFile, self).__init__()
+        self.fileobj = fileobj
+        self.chunks = chunks
+        self.buf = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buf:
+            try:
+                self.buf = next(self.chunks)
+            except StopIteration:
+                return 0
+
+        n = min(len(b), len(self.buf))
+        b[:n] = self.buf[:n]
+        self.buf = self.buf[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.fileobj.close()
+        super(MemberFile, self).close()
 
 
 class ArchiveReader(object):
@@ -18,13 +172,19 @@ class ArchiveReader(object):
 
         if os.path.isdir(path):
             self.tar = None
-            self.meta = util.json_load(os.path.join(path, default.META_FILENAME))
+            self.meta = util.load_meta(path)
             self.archive = io.open(os.path.join(path, self.filename()), 'rb')
+            self.archive_path = os.path.join(path, self.filename())
+            self.archive_offset = 0
 
         else:  # expect tar
             self.tar = tarfile.open(self.path, 'r')
             self.meta = self.get_meta()
             self.archive = self.tar.extractfile(self.filename())
+            self.archive_path = self.path
+            self.archive_offset = self.tar.getmember(self.filename()).offset_data
+
+        self.load_index()
 
     def filename(self):
         return os.path.basename(self.meta['archive'][0])
@@ -39,51 +199,152 @@ class ArchiveReader(object):
 
     def close(self):
         self.archive.close()
-        self.tar.close()
+        if self.tar:
+            self.tar.close()
+
+    def load_index(self):
+        self.members = load_members(self.meta['manifest'])
+        self.index = dict((m.path, m) for m in self.members)
+
+    def get_member_info(self, member):
+        try:
+            return self.index[tuple(member)]
+        except KeyError:
+            raise MemberNotFoundException(util.get_path(*member))
+
+    def _extract_member(self, fileobj, offset, info, extract_path, cb=None,
+                        filename=None):
+        if info.codec == 'stored' and info.size:
+            if filename is None:
+                filename = os.path.join(extract_path, *info.path)
+            with io.open(self.archive_path, 'rb', buffering=0) as archive:
+                extract_stored(archive, self.archive_offset, info, filename, cb=cb)
+            return
+
+        fileobj.seek(offset + info.start)
+        extract_member(fileobj, info, extract_path, cb=cb, filename=filename)
 
     def extract(self, member, extract_path, cb=None):
-        noffset = 0
-        for entry in self.meta['manifest']:
-            if entry['path'] == member:
-                path = os.path.sep.join(entry['path'])
-                size = entry['size']
+        info = self.get_member_info(member)
+        self._extract_member(self.archive, 0, info, extract_path, cb=cb)
 
-                self.archive.seek(noffset)
+    # extracts a member to the given filename instead of its path
+    def extract_file(self, member, filename, cb=None):
+        info = self.get_member_info(member)
+        self._extract_member(self.archive, 0, info, None, cb=cb,
+                             filename=filename)
 
-                checksum = getattr(hashlib, entry['checksum'][0])()
+    def open_member(self, member):
+        info = self.get_member_info(member)
+        fileobj = io.open(self.archive_path, 'rb')
+        fileobj.seek(self.archive_offset + info.start)
+        return io.BufferedReader(MemberFile(fileobj, iter_member(fileobj, info)),
+                                 buffer_size=default.CHUNK_SIZE)
 
-                gz = gzip.GzipFile(fileobj=self.archive)
+    def read_member(self, member, start=0, length=None):
+        info = self.get_member_info(member)
+        if length is None or start + length > info.size:
+            length = max(info.size - start, 0)
+        if not length:
+            return b''
 
-                filename = os.path.join(extract_path, path)
-                util.makedirs(filename)
-                with io.open(filename, 'wb') as f:
+        # stored members are a plain byte range
+        if info.codec == 'stored':
+            with io.open(self.archive_path, 'rb') as f:
+                f.seek(self.archive_offset + info.start + start)
+                return f.read(length)
+
+        # blocked members inflate only the blocks covering the range
+        if info.blocks:
+            first = start // info.block_size
+            last = (start + length - 1) // info.block_size + 1
+            fileobj = io.open(self.archive_path, 'rb')
+            fileobj.seek(self.archive_offset + info.blocks[first][0])
+            chunks = iter_blocks(fileobj, info, info.blocks[first:last])
+            start -= first * info.block_size
+        else:
+            fileobj = io.open(self.archive_path, 'rb')
+            fileobj.seek(self.archive_offset + info.start)
+            chunks = iter_member(fileobj, info)
+
+        with io.BufferedReader(MemberFile(fileobj, chunks),
+                               buffer_size=default.CHUNK_SIZE) as f:
+            # compressed streams cannot seek, skipping means inflating
+            while start > 0:
+                skipped = len(f.read(min(start, default.CHUNK_SIZE)))
+                if not skipped:
+                    break
+                start -= skipped
+            return f.read(length)
 
-                    bytes_read = 0
-                    while True:
-                        chunk = gz.read(min(size - bytes_read, default.CHUNK_SIZE))
-                        if not chunk:
-                            break
+    def extract_parallel(self, extract_path, cb=None, workers=None, members=None):
+        lock = threading.Lock()
+        local = threading.local()
+        handles = []
+        progress = {}
 
-                        bytes_read += len(chunk)
+        def member_cb(info, bytes_read):
+            with lock:
+                progress[info.path] = progress.get(info.path, 0) + bytes_read
+                cb(progress[info.path])
 
-                        f.write(chunk)
-                        checksum.update(chunk)
+        def locked_cb(bytes_read):
+            with lock:
+                cb(bytes_read)
 
-                        # callback for progress tracking
-                        if cb:
-                            cb(bytes_read)
+        # blocks of one file are extracted in parallel too
+        tasks = []
+        for info in members or self.members:
+            if info.blocks:
+                filename = os.path.join(extract_path, *info.path)
+                util.makedirs(filename)
+                with io.open(filename, 'wb') as f:
+                    f.truncate(info.size)
+                tasks.extend((info, i) for i in range(len(info.blocks)))
+            else:
+                tasks.append((info, None))
 
-                gz.close()
+        def work(task):
+            # every worker seeks on a file handle of its own
+            if not hasattr(local, 'fileobj'):
+                local.fileobj = io.open(self.archive_path, 'rb')
+                with lock:
+                    handles.append(local.fileobj)
 
-                # checksums from bytes read and meta data should match
-                if checksum.hexdigest() != entry['checksum'][1]:
-                    raise Exception('checksum mismatch: %s' % path)
+            info, index = task
+            if index is None:
+                self._extract_member(local.fileobj, self.archive_offset,
+                                     info, extract_path, cb=cb and locked_cb)
+            else:
+                local.fileobj.seek(self.archive_offset + info.blocks[index][0])
+                extract_block(local.fileobj, info, index,
+                              os.path.join(extract_path, *info.path),
+                              cb=cb and (lambda n: member_cb(info, n)))
+
+        pool = ThreadPool(workers)
+        try:
+            pool.map(work, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            for fileobj in handles:
+                fileobj.close()
 
-            noffset = entry['noffset']
+    # members optionally restricts extraction to a subset of paths
+    def extract_all(self, extract_path, cb=None, workers=None, members=None):
+        if workers is None:
+            workers = default.EXTRACT_WORKERS
+        if members is not None:
+            members = [self.get_member_info(m) for m in members]
+        else:
+            members = self.members
 
-    def extract_all(self, extract_path, cb=None):
-        for entry in self.meta['manifest']:
-            self.extract(entry['path'], extract_path, cb=cb)
+        if workers > 1:
+            self.extract_parallel(extract_path, cb=cb, workers=workers,
+                                  members=members)
+        else:
+            for info in members:
+                self._extract_member(self.archive, 0, info, extract_path, cb=cb)
 
         members = [m['name'] for m in self.index_members()]
         for member in members:
@@ -100,7 +361,7 @@ class ArchiveReader(object):
         return self.meta[member]
 
     def list(self):
-        return [tuple(e['path']) for e in self.meta['manifest']]
+        return [m.path for m in self.members]
 
     def size_compressed(self):
         return self.meta[-1]['noffset']
@@ -121,3 +382,105 @@ class ArchiveReader(object):
         indices = [m['size'] for m in self.index_members()]
         files = [m['size'] for m in self.meta['manifest']]
         return sum(indices) + sum(files)
+
+
+class ChecksumReader(object):
+    def __init__(self, fileobj, checksum):
+        self.fileobj = fileobj
+        self.checksum = checksum
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.checksum.update(data)
+        return data
+
+
+class StreamArchiveReader(object):
+    # reads an archive in a single pass from a non-seekable source,
+    # e.g., a pipe, stdin or a http response body
+
+    def __init__(self, fileobj, path='-'):
+        self.path = path
+        self.fileobj = fileobj
+        self.tar = tarfile.open(fileobj=fileobj, mode='r|')
+        self.spool = None
+        self.archive = None
+        self.meta_data = None
+
+        # archives built by older versions store archive.gz before
+        # meta.json, in that case spool archive.gz to a temporary file
+        for info in self.tar:
+            if info.name == default.META_FILENAME:
+                self.meta_data = self.tar.extractfile(info).read()
+                self.meta = json.loads(self.meta_data.decode('utf8'))
+                break
+
+            elif info.name == default.ARCHIVE_FILENAME:
+                self.spool = tempfile.TemporaryFile()
+                shutil.copyfileobj(self.tar.extractfile(info), self.spool,
+                                   default.CHUNK_SIZE)
+                self.spool.seek(0)
+
+        if self.meta_data is None:
+            raise Exception('missing %s' % default.META_FILENAME)
+
+        self.members = load_members(self.meta['manifest'])
+
+    def filename(self):
+        return os.path.basename(self.meta['archive'][0])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if isinstance(exc_value, Exception):
+            return False
+        self.close()
+
+    def close(self):
+        if self.spool:
+            self.spool.close()
+        self.tar.close()
+
+    def open_archive(self):
+        if self.spool:
+            return self.spool
+
+        for info in self.tar:
+            if info.name == default.ARCHIVE_FILENAME:
+                return self.tar.extractfile(info)
+        raise Exception('missing %s' % default.ARCHIVE_FILENAME)
+
+    def extract_all(self, extract_path, cb=None, workers=None, members=None):
+        # members arrive in order, there is nothing to parallelize
+        if self.archive is not None:
+            raise Exception('stream already consumed: %s' % self.path)
+        self.archive = self.open_archive()
+        if members is not None:
+            members = set(tuple(m) for m in members)
+
+        checksum = util.new_checksum(self.meta.get('checksum_name', 'md5'))
+        fileobj = ChecksumReader(self.archive, checksum)
+        for info in self.members:
+            if members is None or info.path in members:
+                extract_member(fileobj, info, extract_path, cb=cb)
+            else:
+                skip_member(fileobj, info)
+
+        if checksum.hexdigest() != self.meta['archive'][1]:
+            raise Exception('checksum mismatch: %s' % self.filename())
+
+        path = os.path.join(extract_path, default.META_FILENAME)
+        util.makedirs(path)
+        with io.open(path, 'wb') as f:
+            f.write(self.meta_data)
+
+    def get_member(self, member):
+        return self.meta[member]
+
+    def list(self):
+        return [m.path for m in self.members]
+
+    def size(self):
+        files = [m.size for m in self.members]
+        return len(self.meta_data) + sum(files)
@@ -1,33 +1,70 @@
-import gzip
 import io
 import os
 import tarfile
 import time
 import tempfile
-import hashlib
 import shutil
 import logging
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 from . import util
 from . import default
+from .archive_reader import ArchiveReader
+from .compression import CodecWriter, ParallelGzipWriter, resolve_codec
 
 
 class EmptyArchiveException(Exception): pass
 class InvalidPathException(Exception): pass
 
 
+class ChecksumWriter(object):
+    def __init__(self, fileobj, checksum):
+        self.fileobj = fileobj
+        self.checksum = checksum
+
+    def write(self, data):
+        self.checksum.update(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def close(self):
+        self.fileobj.close()
+
+
 class ArchiveWriter(object):
-    def __init__(self, path, base_path=None):
+    def __init__(self, path, base_path=None, codec=None, compresslevel=None,
+                 block_size=None, threads=None, checksum_name=None,
+                 previous=None):
         self.logger = logging.getLogger(__name__)
 
+        self.codec = codec
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.threads = threads or default.COMPRESS_THREADS
+        self.checksum_name = checksum_name or default.CHECKSUM
         self.base_path = base_path
         self.path = path
+        # archive checksum is updated as members are written
+        self.checksum = util.new_checksum(self.checksum_name)
         self.tmp_path = tempfile.mkdtemp()
         self.tmp_archive_path = os.path.join(self.tmp_path, default.ARCHIVE_FILENAME)
-        self.archive = io.open(self.tmp_archive_path, 'wb')
-        self.meta = {'manifest': []}
+        self.archive = ChecksumWriter(io.open(self.tmp_archive_path, 'wb'),
+                                      self.checksum)
+        self.meta = {'manifest': [], 'checksum_name': self.checksum_name}
+
+        # unchanged members of a previous build are copied, not recompressed
+        self.previous = None
+        if previous and os.path.exists(previous):
+            self.previous = ArchiveReader(previous)
 
     def cleanup(self):
+        if self.previous:
+            self.previous.close()
+            self.previous = None
         shutil.rmtree(self.tmp_path)
         assert not os.path.exists(self.tmp_path)
 
@@ -40,20 +77,17 @@ class ArchiveWriter(object):
 
         mtime = time.time()
 
-        tar = tarfile.open(self.path, 'w')
-        with io.open(self.tmp_archive_path, 'rb') as f:
-            checksum = hashlib.md5(f.read()).hexdigest()
-            f.seek(os.SEEK_SET, 0)
+        # previous may be the very archive that is overwritten now
+        if self.previous:
+            self.previous.close()
+            self.previous = None
 
-            info = tarfile.TarInfo(default.ARCHIVE_FILENAME)
-            info.size = os.stat(self.tmp_archive_path).st_size
-            info.mtime = os.stat(self.tmp_archive_path).st_mtime
-            info.type = tarfile.REGTYPE
-            info.mode = 0o644
-            info.uid = info.gid = 1000
-            tar.addfile(info, f)
-            self.meta['archive'] = (default.ARCHIVE_FILENAME, checksum)
+        self.meta['archive'] = (default.ARCHIVE_FILENAME, self.checksum.hexdigest())
+
+        tar = tarfile.open(self.path, 'w')
 
+        # meta.json goes first so that archives can be read in a single
+        # pass, archive.gz is then copied in chunks from the temporary file
         data = util.json_dump(self.meta)
         with io.BytesIO(data) as f:
             info = tarfile.TarInfo(default.META_FILENAME)
@@ -63,6 +97,15 @@ class ArchiveWriter(object):
             info.mode = 0o644
             info.uid = info.gid = 1000
             tar.addfile(info, f)
+
+        with io.open(self.tmp_archive_path, 'rb') as f:
+            info = tarfile.TarInfo(default.ARCHIVE_FILENAME)
+            info.size = os.stat(self.tmp_archive_path).st_size
+            info.mtime = os.stat(self.tmp_archive_path).st_mtime
+            info.type = tarfile.REGTYPE
+            info.mode = 0o644
+            info.uid = info.gid = 1000
+            tar.addfile(info, f)
         tar.close()
 
         self.cleanup()
@@ -71,45 +114,200 @@ class ArchiveWriter(object):
         self.logger.info("adding %s", name)
         self.meta[name] = obj
 
-    def add(self, path, cb=None):
+    def add(self, path, cb=None, codec=None, compresslevel=None,
+            block_size=None):
+        base = self.archive.tell()
+        entry = self.compress(path, self.archive, cb=cb, codec=codec,
+                              compresslevel=compresslevel,
+                              block_size=block_size)
+        self.append_entry(entry, base)
+
+    # compresses path into fileobj, offsets in the returned manifest
+    # entry are relative to the position fileobj was at
+    def compress(self, path, fileobj, cb=None, codec=None, compresslevel=None,
+                 block_size=None):
         self.logger.info("adding %s", path)
         if self.base_path is None and os.path.isabs(path):
             raise InvalidPathException('cannot handle absolute paths without base_path: %s' % path)
 
-        checksum = hashlib.md5()
+        checksum = util.new_checksum(self.checksum_name)
+        base = fileobj.tell()
+
+        codec = resolve_codec(path, codec or self.codec)
+        if compresslevel is None:
+            compresslevel = self.compresslevel
+
+        # large files are split into independently compressed blocks
+        # to allow parallel decompression and random access
+        size = os.stat(path).st_size
+        block_size = block_size or self.block_size
+        if codec == 'stored' or not block_size or size <= block_size:
+            block_size = None
+
+        meta_path = os.path.relpath(path, self.base_path or '').split(os.path.sep)
+
+        if self.previous:
+            entry = self.reuse(path, meta_path, fileobj, size, codec, block_size)
+            if entry:
+                if cb:
+                    cb(size)
+                return entry
+
+        blocks = []
+        block_checksum = None
+        block_read = 0
+
+        # a single large gzip member is deflated on several threads
+        if codec == 'gzip' and not block_size and self.threads > 1 and \
+                size > default.PARALLEL_CHUNK_SIZE:
+            writer = ParallelGzipWriter(fileobj, compresslevel, self.threads)
+        else:
+            writer = CodecWriter(fileobj, codec, compresslevel)
 
-        gz = gzip.GzipFile(fileobj=self.archive,
-                           compresslevel=default.COMPRESSLEVEL)
         with io.open(path, 'rb') as f:
             bytes_read = 0
 
             while True:
-                chunk = f.read(default.CHUNK_SIZE)
+                chunk_size = default.CHUNK_SIZE
+                if block_size:
+                    chunk_size = min(chunk_size, block_size - block_read)
+
+                chunk = f.read(chunk_size)
                 if not chunk:
                     break
 
+                if writer is None:
+                    writer = CodecWriter(fileobj, codec, compresslevel)
+                if block_size and block_checksum is None:
+                    block_checksum = util.new_checksum(self.checksum_name)
+
                 bytes_read += len(chunk)
 
-                gz.write(chunk)
+                writer.write(chunk)
                 checksum.update(chunk)
 
+                if block_size:
+                    block_checksum.update(chunk)
+                    block_read += len(chunk)
+                    if block_read == block_size:
+                        writer.close()
+                        blocks.append((fileobj.tell() - base, block_checksum.hexdigest()))
+                        writer = block_checksum = None
+                        block_read = 0
+
                 # callback for progress tracking
                 if cb:
                     cb(bytes_read)
 
-        gz.close()
+        if writer is not None:
+            writer.close()
+            if block_size:
+                blocks.append((fileobj.tell() - base, block_checksum.hexdigest()))
 
-        meta_path = os.path.relpath(path, self.base_path or '').split(os.path.sep)
+        entry = {
+            'path': meta_path,
+            'noffset': fileobj.tell() - base,
+            'size': size,
+            'checksum': (self.checksum_name, checksum.hexdigest()),
+            'codec': codec,
+        }
+        if block_size:
+            entry['block_size'] = block_size
+            entry['blocks'] = blocks
+        return entry
+
+    # copies the compressed member of an unchanged file from the previous
+    # archive, files count as unchanged if size and checksum match
+    def reuse(self, path, meta_path, fileobj, size, codec, block_size):
+        info = self.previous.index.get(tuple(meta_path))
+        if info is None or info.size != size or info.codec != codec or \
+                info.block_size != block_size or \
+                info.checksum[0] != self.checksum_name:
+            return
 
-        self.meta['manifest'].append({
+        if util.file_checksum(path, self.checksum_name) != info.checksum[1]:
+            return
+
+        self.logger.info("reusing %s", path)
+        base = fileobj.tell()
+        with io.open(self.previous.archive_path, 'rb') as f:
+            f.seek(self.previous.archive_offset + info.start)
+            length = info.end - info.start
+            while length > 0:
+                chunk = f.read(min(length, default.CHUNK_SIZE))
+                if not chunk:
+                    raise Exception('unexpected end of archive: %s' % self.previous.path)
+                length -= len(chunk)
+                fileobj.write(chunk)
+
+        entry = {
             'path': meta_path,
-            'noffset': self.archive.tell(),
-            'size': os.stat(path).st_size,
-            'checksum': (checksum.name, checksum.hexdigest()),
-        })
+            'noffset': fileobj.tell() - base,
+            'size': size,
+            'checksum': info.checksum,
+            'codec': codec,
+        }
+        if info.blocks:
+            entry['block_size'] = info.block_size
+            entry['blocks'] = [(end - info.start, block_checksum)
+                               for _, end, block_checksum in info.blocks]
+        return entry
+
+    def append_entry(self, entry, base):
+        entry['noffset'] += base
+        if 'blocks' in entry:
+            entry['blocks'] = [(noffset + base, checksum)
+                               for noffset, checksum in entry['blocks']]
+        self.meta['manifest'].append(entry)
+
+    # compresses files on a thread pool into temporary members which are
+    # appended in order, the result is identical to adding them one by one;
+    # members in flight are bounded so temporary files stay small
+    def add_all(self, paths, cb=None, workers=None):
+        if workers is None:
+            workers = default.BUILD_WORKERS
+
+        if workers <= 1:
+            for path in paths:
+                self.add(path, cb=cb)
+            return
+
+        lock = threading.Lock()
+
+        def locked_cb(bytes_read):
+            with lock:
+                cb(bytes_read)
+
+        def work(i, path):
+            member_path = os.path.join(self.tmp_path, '%d.member' % i)
+            with io.open(member_path, 'wb') as f:
+                entry = self.compress(path, f, cb=cb and locked_cb)
+            return member_path, entry
+
+        def append(result):
+            member_path, entry = result.get()
+            base = self.archive.tell()
+            with io.open(member_path, 'rb') as f:
+                shutil.copyfileobj(f, self.archive, default.CHUNK_SIZE)
+            os.remove(member_path)
+            self.append_entry(entry, base)
+
+        pool = ThreadPool(workers)
+        pending = deque()
+        try:
+            for i, path in enumerate(paths):
+                pending.append(pool.apply_async(work, (i, path)))
+                while len(pending) > 2 * workers:
+                    append(pending.popleft())
+            while pending:
+                append(pending.popleft())
+        finally:
+            pool.close()
+            pool.join()
 
-    def add_path(self, path, cb=None):
+    def add_path(self, path, cb=None, workers=None):
+        paths = []
         for root, _, filenames in os.walk(path):
             for filename in filenames:
-                file_path = os.path.join(root, filename)
-                self.add(file_path, cb=cb)
+                paths.append(os.path.join(root, filename))
+        self.add_all(paths, cb=cb, workers=workers)
@@ -1,11 +1,19 @@
 import os
-import hashlib
 import io
 import sys
+import threading
 try:
     from urllib.parse import urljoin
 except ImportError:
     from urlparse import urljoin
+try:
+    from urllib.error import HTTPError
+except ImportError:
+    from urllib2 import HTTPError
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 from . import uget
 from . import util
@@ -13,8 +21,121 @@ from . import default
 from .package_list import PackageList
 from .package_stub import PackageStub
 from .archive import Archive
+from .archive_reader import load_members, extract_member, skip_member
 from .session import Session
 from .cached_package import CachedPackage
+from .pool import Pool
+
+
+def member_key(info):
+    return (info.checksum, info.size, info.codec, info.block_size,
+            info.end - info.start)
+
+
+# drops the first length bytes passed to the returned function
+def skip_chunks(chunk_func, length):
+    skip = [length]
+
+    def func(chunk):
+        if skip[0] < len(chunk):
+            chunk_func(chunk[skip[0]:] if skip[0] else chunk)
+        skip[0] = max(0, skip[0] - len(chunk))
+    return func
+
+
+class ChunkPipe(object):
+    # hands chunks over from a writing to a reading thread
+
+    def __init__(self, maxsize=default.PIPE_SIZE):
+        self.queue = Queue(maxsize)
+        self.buf = b''
+        self.eof = False
+        self.detached = False
+
+    def write(self, chunk):
+        # a detached reader would never consume the queue
+        if chunk and not self.detached:
+            self.queue.put(chunk)
+
+    def close(self):
+        if not self.detached:
+            self.queue.put(b'')
+
+    def detach(self):
+        self.detached = True
+        while not self.queue.empty():
+            self.queue.get()
+
+    def read(self, size=-1):
+        while not self.buf and not self.eof:
+            self.buf = self.queue.get()
+            self.eof = not self.buf
+
+        if size < 0:
+            size = len(self.buf)
+        chunk, self.buf = self.buf[:size], self.buf[size:]
+        return chunk
+
+
+class PipelinedArchiveReader(object):
+    # inflates members while archive.gz is still being downloaded
+
+    def __init__(self, cache, package, delta=False):
+        self.cache = cache
+        self.package = package
+        self.delta = delta
+        self.path = package.path
+        self.meta = util.load_meta(package.path)
+        self.members = load_members(self.meta['manifest'])
+
+    def filename(self):
+        return os.path.basename(self.meta['archive'][0])
+
+    def close(self):
+        pass
+
+    def extract_all(self, extract_path, cb=None, workers=None, members=None):
+        pipe = ChunkPipe()
+        errors = []
+        if members is not None:
+            members = set(tuple(m) for m in members)
+
+        def extract():
+            try:
+                for info in self.members:
+                    if members is None or info.path in members:
+                        extract_member(pipe, info, extract_path, cb=cb)
+                    else:
+                        skip_member(pipe, info)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                pipe.detach()
+
+        thread = threading.Thread(target=extract)
+        thread.start()
+        try:
+            # the cached copy is still written to allow resuming
+            self.cache.download(self.package, chunk_func=pipe.write,
+                                delta=self.delta)
+        finally:
+            pipe.close()
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        util.write_meta(extract_path, self.meta)
+
+    def get_member(self, member):
+        return self.meta[member]
+
+    def list(self):
+        return [m.path for m in self.members]
+
+    def size(self):
+        meta_size = os.stat(os.path.join(self.path, default.META_FILENAME)).st_size
+        return meta_size + sum(m.size for m in self.members)
 
 
 class Cache(PackageList):
@@ -27,6 +148,18 @@ class Cache(PackageList):
 
         super(Cache, self).__init__(app_name, app_version, cache_path, **kwargs)
 
+    # archives of lazy installs in the pool are kept
+    def purge(self):
+        pool = Pool(self.app_name, self.app_version, self.data_path)
+        used = set(pkg.meta['lazy'] for pkg in pool.lazy_packages())
+
+        self.logger.info('purging %s', self.__class__.__name__)
+        for package in self.find():
+            if os.path.abspath(package.path) in used:
+                self.logger.info('keep %s for lazy installs', package.ident)
+                continue
+            self.remove(package)
+
     def exists(self, ident, etag):
         packages = [p for p in self.find() if p.ident == ident]
         if packages:
@@ -34,7 +167,9 @@ class Cache(PackageList):
             return packages[0].meta['etag'] == etag
         return False
 
-    def update(self, meta, url, etag=None):
+    # pass reload=False when updating in a loop and call load() with the
+    # updated idents in refresh afterwards
+    def update(self, meta, url, etag=None, reload=True):
         assert len(meta['archive']) == 2
         meta = dict(meta)
 
@@ -43,29 +178,135 @@ class Cache(PackageList):
         meta['archive'].append(urljoin(url, meta['archive'][0]))
         meta['etag'] = etag
 
-        path = os.path.join(self.path, package.ident,
-                            default.META_FILENAME)
+        util.write_meta(os.path.join(self.path, package.ident), meta)
 
-        util.makedirs(path)
-        with io.open(path, 'wb') as f:
-            f.write(util.json_dump(meta))
+        # meta.json of an existing package changes in place
+        if reload:
+            self.load(refresh=[package.ident])
 
-        # TODO optimize for calling update in a loop
-        self.load()
-
-    def fetch(self, package_string):
+    def fetch(self, package_string, pipelined=False, delta=False):
         package = self.get(package_string)
+
+        if pipelined:
+            return Archive(package.path,
+                           reader=PipelinedArchiveReader(self, package, delta))
+
+        self.download(package, delta=delta)
+        return Archive(package.path)
+
+    # members of other complete cached archives of the same package
+    def local_members(self, package):
+        res = {}
+        for other in self.find(package.name):
+            if other.ident == package.ident:
+                continue
+
+            path = os.path.join(other.path, other.meta['archive'][0])
+            members = load_members(other.manifest)
+            if not members or not os.path.isfile(path) or \
+                    os.path.getsize(path) != members[-1].end:
+                continue
+
+            for info in members:
+                res[member_key(info)] = (path, info.start)
+        return res
+
+    # assembles archive.gz from members of cached archives and http range
+    # requests for the rest, returns True if complete or else the number of
+    # bytes already handed to chunk_func
+    def download_delta(self, package, full_path, session, chunk_func=None):
+        local = self.local_members(package)
+        if not local:
+            return 0
+
+        _, archive_checksum, url = package.meta['archive'][:3]
+        members = load_members(package.manifest)
+
+        # (local path or None for remote, offset, length)
+        segments = []
+        for info in members:
+            src, offset = local.get(member_key(info), (None, info.start))
+            length = info.end - info.start
+            if not length:
+                continue
+
+            if segments and segments[-1][0] == src and \
+                    sum(segments[-1][1:]) == offset:
+                segments[-1] = (src, segments[-1][1], segments[-1][2] + length)
+            else:
+                segments.append((src, offset, length))
+
+        remote = sum(length for src, _, length in segments if src is None)
+        self.logger.info('delta download %d of %d bytes', remote, members[-1].end)
+
+        checksum = util.new_checksum(package.meta.get('checksum_name', 'md5'))
+        written = [0]
+        with io.open(full_path + '.delta', 'wb') as f:
+
+            def write(chunk):
+                f.write(chunk)
+                checksum.update(chunk)
+                written[0] += len(chunk)
+                if chunk_func:
+                    chunk_func(chunk)
+
+            for src, offset, length in segments:
+                if src is None:
+                    try:
+                        uget.read_range(session, url, offset, length, write_func=write)
+                    except (uget.UnsupportedHTTPCodeException,
+                            uget.InvalidOffsetException, HTTPError) as e:
+                        # e.g., servers ignoring ranges, fall back to a
+                        # full download
+                        self.logger.info('delta download failed: %r', e)
+                        f.close()
+                        os.remove(full_path + '.delta')
+                        # the bytes written so far match the remote archive
+                        return written[0]
+                    continue
+
+                with io.open(src, 'rb') as local_file:
+                    local_file.seek(offset)
+                    while length > 0:
+                        chunk = local_file.read(min(length, default.CHUNK_SIZE))
+                        if not chunk:
+                            raise Exception('unexpected end of archive: %s' % src)
+                        length -= len(chunk)
+                        write(chunk)
+
+        # reused members might have been compressed differently
+        if checksum.hexdigest() != archive_checksum:
+            self.logger.info('delta download checksum mismatch')
+            os.remove(full_path + '.delta')
+            # chunks handed out already cannot be taken back, members were
+            # checked by the extraction, only fix the cached copy
+            return written[0]
+
+        os.rename(full_path + '.delta', full_path)
+        return True
+
+    def download(self, package, chunk_func=None, delta=False):
         path, checksum, url = package.meta['archive'][:3]
+        checksum_name = package.meta.get('checksum_name', 'md5')
 
         full_path = os.path.join(package.path, path)
         util.makedirs(full_path)
 
         session = Session(self.app_name, self.app_version, self.data_path)
+
+        if delta and not os.path.exists(full_path):
+            res = self.download_delta(package, full_path, session, chunk_func)
+            if res is True:
+                return
+
+            # continue the stream after the chunks handed out already
+            if chunk_func and res:
+                chunk_func = skip_chunks(chunk_func, res)
+
         uget.download(session, url, full_path,
                       console=sys.stdout,
-                      checksum=hashlib.md5(),
-                      checksum_header=util.s3_header('md5'))
+                      checksum=util.new_checksum(checksum_name),
+                      checksum_header=util.s3_header(checksum_name),
+                      chunk_func=chunk_func)
 
         # TODO: use checksum
-
-        return Archive(package.path)
@@ -7,14 +7,24 @@ from .package_stub import PackageStub
 
 
 class CachedPackage(PackageStub):
-    def __init__(self, path):
-        meta = util.json_load(os.path.join(path, default.META_FILENAME))
-        super(CachedPackage, self).__init__(defaults=meta['package'])
+    def __init__(self, path, defaults=None):
+        self.path = path
+        self._meta = None
+        self._manifest = None
+        if defaults is None:
+            defaults = self.meta['package']
+        super(CachedPackage, self).__init__(defaults=defaults)
 
         self.logger = logging.getLogger(__name__)
-        self.meta = meta
-        self.path = path
+
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = util.json_load(os.path.join(self.path, default.META_FILENAME))
+        return self._meta
 
     @property
     def manifest(self):
-        return self.meta['manifest']
+        if self._manifest is None:
+            self._manifest = util.load_manifest(self.path, self.meta)
+        return self._manifest
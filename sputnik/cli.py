@@ -1,9 +1,10 @@
 # pylint: disable=C0330
+import sys
 import argparse
 import logging
 
 from . import default
-from . import install, build, remove, search, find, upload, update, files, purge
+from . import install, build, remove, search, find, upload, update, files, verify, purge
 
 
 def set_log_level(args):
@@ -21,11 +22,24 @@ def add_build_parser(subparsers):
     parser.add_argument('archive_path',
         nargs='?',
         help='archive path')
+    parser.add_argument('--workers',
+        default=default.BUILD_WORKERS,
+        type=int,
+        help='number of parallel compression workers')
+    parser.add_argument('--threads',
+        default=default.COMPRESS_THREADS,
+        type=int,
+        help='number of threads compressing a single large file')
+    parser.add_argument('--previous',
+        help='previous archive to reuse unchanged files from')
 
     def run(args):
         set_log_level(args)
         build(package_path=args.package_path,
-              archive_path=args.archive_path)
+              archive_path=args.archive_path,
+              workers=args.workers,
+              threads=args.threads,
+              previous=args.previous)
 
     parser.set_defaults(run=run)
 
@@ -34,7 +48,27 @@ def add_install_parser(subparsers):
     parser = subparsers.add_parser('install',
         help='install package from repository or filesystem')
     parser.add_argument('package_name',
-        help='package name or path')
+        help='package name or path, - reads from stdin')
+    parser.add_argument('--workers',
+        default=default.EXTRACT_WORKERS,
+        type=int,
+        help='number of parallel extraction workers')
+    parser.add_argument('--pipelined',
+        default=default.install_pipelined,
+        action='store_true',
+        help='extract while downloading')
+    parser.add_argument('--dedup',
+        default=default.pool_dedup,
+        action='store_true',
+        help='deduplicate files through a content-addressed store')
+    parser.add_argument('--delta',
+        default=default.install_delta,
+        action='store_true',
+        help='only download members that differ from cached archives')
+    parser.add_argument('--lazy',
+        default=default.install_lazy,
+        action='store_true',
+        help='extract files on first access')
 
     def run(args):
         set_log_level(args)
@@ -42,7 +76,12 @@ def add_install_parser(subparsers):
                 app_version=args.version,
                 package_name=args.package_name,
                 data_path=args.data_path,
-                repository_url=args.repository_url)
+                repository_url=args.repository_url,
+                workers=args.workers,
+                pipelined=args.pipelined,
+                dedup=args.dedup,
+                delta=args.delta,
+                lazy=args.lazy)
 
     parser.set_defaults(run=run)
 
@@ -156,6 +195,36 @@ def add_files_parser(subparsers):
     parser.set_defaults(run=run)
 
 
+def add_verify_parser(subparsers):
+    parser = subparsers.add_parser('verify',
+        help='verifies installed package files')
+    parser.add_argument('package_string',
+        nargs='?',
+        default=default.find_package_string,
+        help='package string')
+    parser.add_argument('--fast',
+        default=default.verify_fast,
+        action='store_true',
+        help='skip files unchanged since the last verification')
+    parser.add_argument('--workers',
+        type=int,
+        default=default.VERIFY_WORKERS,
+        help='number of files to hash in parallel (default: %d)' % default.VERIFY_WORKERS)
+
+    def run(args):
+        set_log_level(args)
+        res = verify(app_name=args.name,
+                     app_version=args.version,
+                     package_string=args.package_string,
+                     fast=args.fast,
+                     workers=args.workers,
+                     data_path=args.data_path)
+        if any(res.values()):
+            sys.exit(1)
+
+    parser.set_defaults(run=run)
+
+
 def add_purge_parser(subparsers):
     parser = subparsers.add_parser('purge',
         help='purges downloaded data')
@@ -202,6 +271,7 @@ def get_parser():
     add_upload_parser(subparsers)
     add_update_parser(subparsers)
     add_files_parser(subparsers)
+    add_verify_parser(subparsers)
     add_purge_parser(subparsers)
 
     return parser
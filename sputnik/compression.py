@@ -0,0 +1,261 @@
+import io
+import os
+import sys
+import bz2
+import zlib
+import struct
+import collections
+from multiprocessing.pool import ThreadPool
+try:
+    import lzma
+except ImportError:
+    lzma = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import default
+
+
+class UnknownCodecException(Exception): pass
+
+
+class Codec(object):
+    def __init__(self, name, compressor, decompressor, compresslevel=None):
+        self.name = name
+        self.compresslevel = compresslevel
+        self._compressor = compressor
+        self._decompressor = decompressor
+
+    def compressor(self, compresslevel=None):
+        if compresslevel is None:
+            compresslevel = self.compresslevel
+        return self._compressor(compresslevel)
+
+    def decompressor(self):
+        return self._decompressor()
+
+
+class Identity(object):
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b''
+
+
+class ZstdCompressor(object):
+    def __init__(self, compresslevel):
+        self.obj = zstandard.ZstdCompressor(level=compresslevel).compressobj()
+
+    def compress(self, data):
+        return self.obj.compress(data)
+
+    def flush(self):
+        return self.obj.flush()
+
+
+codecs = {}
+
+
+def register_codec(codec):
+    codecs[codec.name] = codec
+
+
+def get_codec(name):
+    try:
+        return codecs[name]
+    except KeyError:
+        raise UnknownCodecException('unsupported codec: %s' % name)
+
+
+register_codec(Codec('stored',
+    lambda level: Identity(),
+    Identity))
+
+# gzip members without file name and mtime, so builds are reproducible
+register_codec(Codec('gzip',
+    lambda level: zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+    lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    default.COMPRESSLEVEL))
+
+register_codec(Codec('zlib',
+    zlib.compressobj,
+    zlib.decompressobj,
+    default.COMPRESSLEVEL))
+
+register_codec(Codec('bz2',
+    bz2.BZ2Compressor,
+    bz2.BZ2Decompressor,
+    9))
+
+if lzma:
+    register_codec(Codec('lzma',
+        lambda level: lzma.LZMACompressor(preset=level),
+        lzma.LZMADecompressor,
+        6))
+
+if zstandard:
+    register_codec(Codec('zstd',
+        ZstdCompressor,
+        lambda: zstandard.ZstdDecompressor().decompressobj(),
+        3))
+
+
+class CodecWriter(object):
+    def __init__(self, fileobj, codec, compresslevel=None):
+        self.fileobj = fileobj
+        self.compressor = get_codec(codec).compressor(compresslevel)
+
+    def write(self, data):
+        self.fileobj.write(self.compressor.compress(data))
+
+    def close(self):
+        self.fileobj.write(self.compressor.flush())
+
+
+# gzip header without file name and mtime
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+GZIP_WINDOW = 1024 * 32
+
+
+def deflate_chunk(args):
+    data, zdict, last, compresslevel = args
+    if zdict:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      zlib.DEF_MEM_LEVEL, zlib.Z_DEFAULT_STRATEGY, zdict)
+    else:
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + \
+        compressor.flush(last and zlib.Z_FINISH or zlib.Z_SYNC_FLUSH)
+
+
+class ParallelGzipWriter(object):
+    # pigz-style gzip writer, chunks are deflated on a thread pool and
+    # concatenated into a single gzip stream that any reader understands
+
+    def __init__(self, fileobj, compresslevel=None, threads=None,
+                 chunk_size=default.PARALLEL_CHUNK_SIZE):
+        if compresslevel is None:
+            compresslevel = default.COMPRESSLEVEL
+
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.threads = threads or default.COMPRESS_THREADS
+        self.chunk_size = chunk_size
+        self.pool = ThreadPool(self.threads)
+        self.pending = collections.deque()
+        self.pieces = []
+        self.buffered = 0
+        self.zdict = None
+        self.crc = 0
+        self.size = 0
+
+        self.fileobj.write(GZIP_HEADER)
+
+    def submit(self, data, last=False):
+        self.pending.append(self.pool.apply_async(deflate_chunk,
+            [(data, self.zdict, last, self.compresslevel)]))
+
+        # continue the previous chunk's window, only python >=3.3
+        if sys.version_info >= (3, 3):
+            self.zdict = data[-GZIP_WINDOW:]
+
+        # bound the number of chunks in flight
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+
+        self.pieces.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            buf = b''.join(self.pieces)
+            while len(buf) >= self.chunk_size:
+                self.submit(buf[:self.chunk_size])
+                buf = buf[self.chunk_size:]
+            self.pieces = [buf]
+            self.buffered = len(buf)
+
+    def close(self):
+        try:
+            self.submit(b''.join(self.pieces), last=True)
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().get())
+        finally:
+            self.pool.close()
+            self.pool.join()
+
+        self.fileobj.write(struct.pack('<II', self.crc & 0xffffffff,
+                                       self.size & 0xffffffff))
+
+
+def is_compressible(path):
+    if os.path.splitext(path)[1].lower() in default.STORED_EXTENSIONS:
+        return False
+
+    # sample a block and see whether it shrinks
+    with io.open(path, 'rb') as f:
+        sample = f.read(default.SAMPLE_SIZE)
+    if not sample:
+        return False
+    return len(zlib.compress(sample, 1)) < len(sample) * default.STORED_RATIO
+
+
+def resolve_codec(path, codec=None):
+    codec = codec or default.CODEC
+    if codec == 'auto':
+        return is_compressible(path) and 'gzip' or 'stored'
+    return get_codec(codec).name
+
+
+# reads length bytes in chunks, reusing one buffer where possible
+def iter_read(fileobj, length, chunk_size, reuse=True):
+    if not reuse or not hasattr(fileobj, 'readinto') or sys.version_info < (3,):
+        while length > 0:
+            data = fileobj.read(min(length, chunk_size))
+            if not data:
+                raise Exception('unexpected end of archive')
+            length -= len(data)
+            yield data
+        return
+
+    buf = memoryview(bytearray(min(length, chunk_size)))
+    while length > 0:
+        n = fileobj.readinto(buf[:min(length, chunk_size)])
+        if not n:
+            raise Exception('unexpected end of archive')
+        length -= n
+        yield buf[:n]
+
+
+# yields decompressed chunks of a member of length bytes
+def iter_decompress(fileobj, length, codec='gzip', chunk_size=None):
+    decompressor = get_codec(codec).decompressor()
+    chunk_size = chunk_size or default.CHUNK_SIZE
+
+    # stored data is passed on as is and must not share a buffer
+    for data in iter_read(fileobj, length, chunk_size, reuse=codec != 'stored'):
+        # bound memory for zlib based codecs
+        if hasattr(decompressor, 'unconsumed_tail'):
+            while data:
+                chunk = decompressor.decompress(data, chunk_size)
+                if chunk:
+                    yield chunk
+                data = decompressor.unconsumed_tail
+
+        else:
+            chunk = decompressor.decompress(data)
+            if chunk:
+                yield chunk
+
+    if hasattr(decompressor, 'flush'):
+        chunk = decompressor.flush()
+        if chunk:
+            yield chunk
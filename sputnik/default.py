@@ -7,11 +7,39 @@ build_package_path = '.'
 repository_url = 'https://index.spacy.io'
 purge_cache = False
 purge_pool = False
+pool_dedup = False
+install_delta = False
+install_lazy = False
+install_pipelined = False
+verify_fast = False
 
 # misc
 CHUNK_SIZE = 1024 * 16
+MAX_BUFFER_SIZE = 1024 * 1024 * 4
+VERSION_CACHE_SIZE = 1024 * 64
+CONSTRAINT_CACHE_SIZE = 1024
 ARCHIVE_FILENAME = 'archive.gz'
 META_FILENAME = 'meta.json'
+MANIFEST_FILENAME = 'manifest.json'
 COMPRESSLEVEL = 9
+CHECKSUM = 'md5'
 COOKIES_FILENAME = 'cookies.txt'
 CACHE_DIRNAME = '__cache__'
+OBJECTS_DIRNAME = '__objects__'
+REGISTRY_DIRNAME = '__registry__'
+REGISTRY_FILENAME = 'packages.json'
+MTIME_GRANULARITY = 2  # seconds, fat has the coarsest
+LAZY_TMP_AGE = 60  # seconds without writes until a lazy extraction is stale
+EXTRACT_WORKERS = 1
+BUILD_WORKERS = 1
+PIPE_SIZE = 64
+CODEC = 'gzip'  # see compression.codecs or auto
+SAMPLE_SIZE = 1024 * 64
+STORED_RATIO = 0.9
+STORED_EXTENSIONS = ('.gz', '.tgz', '.bz2', '.xz', '.zip', '.npz', '.zst',
+                     '.jpg', '.jpeg', '.png', '.sputnik')
+COMPRESS_THREADS = 1
+PARALLEL_CHUNK_SIZE = 1024 * 1024
+VERIFY_FILENAME = 'verify.json'  # within REGISTRY_DIRNAME
+VERIFY_WORKERS = 4  # hashing releases the GIL
+VERIFY_CHUNK_SIZE = 1024 * 1024
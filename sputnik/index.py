@@ -1,6 +1,5 @@
 import os
 import json
-import hashlib
 import time
 import logging
 try:
@@ -9,6 +8,7 @@ except ImportError:
     from urlparse import urljoin
 
 from . import util
+from . import default
 from .archive import Archive
 from .session import Session, GetRequest, PutRequest
 from .cache import Cache
@@ -50,10 +50,14 @@ class Index(object):
 
         # to allow random access we upload each archive member individually
         archive = Archive(path)
+        checksum_name = archive.archive.meta.get('checksum_name', 'md5')
         for key_name, f in archive.fileobjs().items():
             self.logger.info('preparing upload for %s', key_name)
+            checksum = util.new_checksum(checksum_name)
+            for chunk in iter(lambda: f.read(default.CHUNK_SIZE), b''):
+                checksum.update(chunk)
             headers = {
-                util.s3_header('md5'): hashlib.md5(f.read()).hexdigest()
+                util.s3_header(checksum_name): checksum.hexdigest()
             }
             f.seek(os.SEEK_SET, 0)
 
@@ -83,6 +87,8 @@ class Index(object):
 
         index = json.load(session.open(request, 'utf8'))
 
+        # the cache is reloaded once for all updated packages
+        updated = []
         for ident, (meta_url, etag) in index.items():
             if not cache.exists(ident, etag):
                 url = urljoin(self.repository_url, meta_url)
@@ -96,14 +102,17 @@ class Index(object):
                 # index server's etag should match s3's etag
                 if util.unquote(response.headers['etag']) != etag:
                     self.logger.info('wait for index server to sync')
+                    cache.load(refresh=updated)
                     time.sleep(3)
                     return self.update(max_retries - 1)
 
                 assert util.unquote(response.headers['etag']) == etag
-                cache.update(meta, url=url, etag=etag)
+                cache.update(meta, url=url, etag=etag, reload=False)
+                updated.append(ident)
 
             # shrink list by one
             packages = [p for p in packages if p.ident != ident]
+        cache.load(refresh=updated)
 
         # remove leftovers
         for package in packages:
@@ -0,0 +1,72 @@
+import os
+import errno
+import logging
+
+from . import util
+
+
+class ObjectStore(object):
+    # content-addressed files keyed by manifest checksum, installed
+    # packages hard-link into the store and the link count of an object
+    # serves as its reference count
+
+    def __init__(self, path):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def create(self):
+        if not self.exists():
+            os.makedirs(self.path)
+
+    def object_path(self, checksum):
+        name, hexdigest = checksum
+        return os.path.join(self.path, name, hexdigest[:2], hexdigest[2:])
+
+    def get(self, checksum, size):
+        path = self.object_path(checksum)
+        if os.path.isfile(path) and os.path.getsize(path) == size:
+            return path
+
+    def add(self, path, checksum):
+        obj = self.object_path(checksum)
+        util.makedirs(obj)
+        try:
+            os.link(path, obj)
+            return
+        except AttributeError:  # no os.link, no deduplication
+            return
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                self.logger.info('cannot link %s: %s', path, e)
+                return
+
+        if os.path.samefile(path, obj):
+            return
+
+        # path was verified on extraction, a truncated object is replaced
+        # instead of spreading into new installs
+        if os.path.getsize(obj) != os.path.getsize(path):
+            self.logger.warning('replace corrupted object %s', obj)
+            tmp = '%s.%d' % (obj, os.getpid())
+            os.link(path, tmp)
+            os.rename(tmp, obj)
+            return
+
+        # replace duplicate by a link to the existing object
+        tmp = path + '.link'
+        os.link(obj, tmp)
+        os.rename(tmp, path)
+
+    def collect(self):
+        removed = 0
+        for root, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+                    removed += 1
+        self.logger.info('collected %d objects', removed)
+        return removed
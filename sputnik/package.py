@@ -1,29 +1,59 @@
 import os
 import logging
+import tempfile
+import threading
 
 from . import util
 from . import default
 from .package_stub import PackageStub
+from .archive_reader import ArchiveReader
+from .shared import SharedMember, segment_name
 
 
 class NotIncludedException(Exception): pass
+class ArchiveNotFoundException(Exception): pass
 
 
 class Package(PackageStub):  # installed package
-    def __init__(self, path):
-        meta = util.json_load(os.path.join(path, default.META_FILENAME))
-        super(Package, self).__init__(defaults=meta['package'])
+    def __init__(self, path, defaults=None):
+        self.path = path
+        self._meta = None
+        self._manifest = None
+        self._entries = None
+        if defaults is None:
+            defaults = self.meta['package']
+        super(Package, self).__init__(defaults=defaults)
 
         self.logger = logging.getLogger(__name__)
-        self.meta = meta
-        self.path = path
 
+        # lazily installed packages extract files on first access
+        self.lock = threading.Lock()
+        self.archive = None
+
+    # parsed on first access, packages listed from the registry might
+    # never need it
+    @property
+    def meta(self):
+        if self._meta is None:
+            self._meta = util.json_load(os.path.join(self.path, default.META_FILENAME))
+        return self._meta
+
+    # loaded on first access from manifest.json, or from meta.json for
+    # packages installed by older versions
     @property
     def manifest(self):
-        return self.meta['manifest']
+        if self._manifest is None:
+            self._manifest = util.load_manifest(self.path, self.meta)
+        return self._manifest
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = dict((tuple(m['path']), m) for m in self.manifest)
+        return self._entries
 
     def has_file(self, *path_parts):
-        return any(m for m in self.manifest if tuple(m['path']) == path_parts)
+        return path_parts in self.entries
 
     def file_path(self, *path_parts):
         path = util.get_path(*path_parts)
@@ -31,7 +61,50 @@ class Package(PackageStub):  # installed package
         if not self.has_file(*path_parts):
             raise NotIncludedException('package does not include file: %s' % path)
 
-        return os.path.join(self.path, path)
+        full_path = os.path.join(self.path, path)
+        if self.meta.get('lazy') and not os.path.isfile(full_path):
+            self.materialize(path_parts, full_path)
+        return full_path
+
+    def materialize(self, path_parts, full_path):
+        with self.lock:
+            if os.path.isfile(full_path):
+                return
+
+            if self.archive is None:
+                if not os.path.exists(self.meta['lazy']):
+                    raise ArchiveNotFoundException(
+                        'archive of lazy install %s not found: %s' %
+                        (self.ident, self.meta['lazy']))
+                self.archive = ArchiveReader(self.meta['lazy'])
+
+            # other threads and processes might extract the same file at
+            # the same time, each into a temporary file of its own, the
+            # rename makes sure nobody sees a partial file; kept in the
+            # package directory for Pool.cleanup
+            self.logger.info('extract %s', util.get_path(*path_parts))
+            util.makedirs(full_path)
+            fd, tmp = tempfile.mkstemp(dir=self.path,
+                                       prefix=os.path.basename(full_path) + '.',
+                                       suffix='.lazy')
+            os.close(fd)
+            try:
+                self.archive.extract_file(path_parts, tmp)
+                os.rename(tmp, full_path)
+            except OSError:  # windows does not replace existing files
+                if not os.path.isfile(full_path):
+                    raise
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    # loads a file into shared memory once per host, keyed by package
+    # and file checksum so processes can attach to it by name
+    def shared_memory(self, *path_parts):
+        filename = self.file_path(*path_parts)
+        entry = self.entries[path_parts]
+        name = segment_name(self.ident, entry['checksum'])
+        return SharedMember(name, filename, entry['size'])
 
     def dir_path(self, *path_parts):
         # TODO check whether path is part of package
@@ -1,6 +1,9 @@
 import os
+import io
 import logging
+import time
 import shutil
+import threading
 
 from . import default
 from . import util
@@ -16,6 +19,10 @@ class PackageList(object):
 
     package_class = PackageStub
 
+    # instances shared within the process, see cached()
+    instances = {}
+    instances_lock = threading.Lock()
+
     def __init__(self, app_name, app_version, path, **kwargs):
         super(PackageList, self).__init__()
 
@@ -32,10 +39,55 @@ class PackageList(object):
 
         self.load()
 
-    def packages(self):
+    # returns a shared instance that is reloaded when the directory or
+    # its registry changed, so repeated lookups only cost two stat calls
+    @classmethod
+    def cached(cls, app_name, app_version, path, **kwargs):
+        key = (cls, app_name, app_version, path)
+        with cls.instances_lock:
+            obj = cls.instances.get(key)
+            if obj is None:
+                obj = cls.instances[key] = cls(app_name, app_version, path, **kwargs)
+            else:
+                obj.refresh()
+        return obj
+
+    def refresh(self):
+        if self.generation != (util.mtime(self.path), util.mtime(self.registry_path)):
+            self.load()
+
+    @property
+    def registry_path(self):
+        return os.path.join(self.path, default.REGISTRY_DIRNAME,
+                            default.REGISTRY_FILENAME)
+
+    def packages(self, refresh=None):
+        for path, defaults in self.load_registry(refresh).items():
+            yield self.__class__.package_class(path=os.path.join(self.path, path),
+                                               defaults=defaults)
+
+    # package fields by directory, kept in a registry file that is valid
+    # as long as the directory is unchanged so meta.json files are only
+    # parsed for new packages or the ones passed in refresh
+    def load_registry(self, refresh=None):
+        registry_path = self.registry_path
         if not os.path.exists(self.path):
             os.makedirs(self.path)
 
+        registry = {}
+        if os.path.isfile(registry_path):
+            try:
+                registry = util.json_load(registry_path)
+            except ValueError:
+                self.logger.warning('ignore invalid registry %s', registry_path)
+
+        mtime = util.mtime(self.path)
+        if registry.get('mtime') == mtime and not refresh:
+            self.generation = (mtime, util.mtime(registry_path))
+            return registry['packages']
+
+        res = {}
+        known = registry.get('packages', {})
         for path in os.listdir(self.path):
             if path.endswith('.tmp'):
                 continue
@@ -44,30 +96,87 @@ class PackageList(object):
             if not os.path.isfile(meta_path):
                 continue
 
-            yield self.__class__.package_class(path=os.path.join(self.path, path))
+            if path in known and path not in (refresh or []):
+                res[path] = known[path]
+            else:
+                res[path] = util.json_load(meta_path)['package']
+
+        # changes within the same clock tick keep the mtime, so a recent
+        # mtime cannot be trusted later on
+        if time.time() - os.path.getmtime(self.path) < default.MTIME_GRANULARITY:
+            mtime = None
+
+        # written to a subdirectory, so it does not change the mtime
+        tmp = '%s.%d' % (registry_path, os.getpid())
+        try:
+            util.makedirs(registry_path)
+            with io.open(tmp, 'wb') as f:
+                f.write(util.json_dump({'mtime': mtime, 'packages': res}))
+            os.rename(tmp, registry_path)
+        except (IOError, OSError) as e:  # read-only data path
+            self.logger.info('cannot write registry %s: %s', registry_path, e)
+        self.generation = (mtime, util.mtime(registry_path))
+        return res
 
-    def load(self):
-        self._packages = {}
-        for package in self.packages():
-            self._packages[package.ident] = package
+    def load(self, refresh=None):
+        # unchanged packages keep their instances and loaded meta data
+        previous = dict((p.path, p) for p in getattr(self, '_packages', {}).values())
+        refresh = refresh or []
+
+        packages_ = {}
+        for package in self.packages(refresh):
+            if os.path.basename(package.path) not in refresh:
+                package = previous.get(package.path, package)
+            packages_[package.ident] = package
+
+        # packages by name in ascending version order
+        versions = {}
+        for package in packages_.values():
+            versions.setdefault(package.name, []).append(package)
+        for name, packages in versions.items():
+            packages.sort(key=lambda p: p.version_key)
+            versions[name] = ([p.version_key for p in packages], packages)
+
+        # shared instances are read by other threads meanwhile, publish
+        # complete indices only and reset resolved packages last
+        self._packages = packages_
+        self._versions = versions
+        self._resolved = {}
 
     def get(self, package_string):
-        candidates = self.find(util.split_package_string(package_string)[0])
+        # resolved packages are kept until the next load()
+        resolved = self._resolved
+        if package_string not in resolved:
+            resolved[package_string] = self.resolve(package_string)
+        return resolved[package_string]
+
+    def resolve(self, package_string):
+        name = util.split_package_string(package_string)[0]
+        candidates = self.find(name)
         if not candidates:
             raise PackageNotFoundException(package_string)
 
-        candidates = sorted(self.find(package_string))
+        # named results are sorted already
+        candidates = self.find(package_string)
+        if not name:
+            candidates = sorted(candidates)
         if not candidates:
             raise CompatiblePackageNotFoundException(package_string)
         return candidates[-1]
 
     def find(self, package_string=None):
-        res = []
-        for package in self._packages.values():
-            name, constraint = util.split_package_string(package_string)
-            if not name or name == package.name and util.constraint_match(constraint, package.version):
-                res.append(package)
-        return res
+        name, constraint = util.split_package_string(package_string)
+        if not name:
+            return list(self._packages.values())
+
+        keys, packages = self._versions.get(name, ([], []))
+        if not packages:
+            return []
+
+        bounds = util.constraint_range(constraint, keys)
+        if bounds is None:
+            return [p for p in packages if util.constraint_match(constraint, p.version)]
+        return packages[bounds[0]:bounds[1]]
 
     def purge(self):
         self.logger.info('purging %s', self.__class__.__name__)
@@ -86,4 +195,4 @@ class PackageList(object):
             self.logger.info('remove %s', package.ident)
             shutil.rmtree(tmp)
 
-        self.load()
+        self.load(refresh=[os.path.basename(package.path)])
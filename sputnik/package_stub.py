@@ -1,13 +1,13 @@
 import io
+import os
 import json
+import mmap
 import contextlib
 try:
     from types import TypeType as type
 except ImportError:
     pass
 
-import semver
-
 from . import util
 
 
@@ -70,6 +70,17 @@ class PackageStub(object):
             else:
                 yield default
 
+    def mmap(self, *path_parts):
+        # read-only mapping, processes mapping the same file share its pages
+        with io.open(self.file_path(*path_parts), 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:  # empty files cannot be mapped
+                return memoryview(b'')
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def load_npy(self, *path_parts):
+        import numpy
+        return numpy.load(self.file_path(*path_parts), mmap_mode='r')
+
     def load_json(self, path_parts, mode='r', encoding='utf8', default=IOError):
         if self.has_file(*path_parts):
             with io.open(self.file_path(*path_parts),
@@ -84,21 +95,25 @@ class PackageStub(object):
             else:
                 return default
 
+    @property
+    def version_key(self):
+        return util.parse_version(self.version)
+
     def _error_on_different_name(self, other):
         if self.name != other.name:
             raise Exception('name mismatch: %s != %s' % (self.name, other.name))
 
     def __gt__(self, other):
         self._error_on_different_name(other)
-        return semver.compare(self.version, other.version) > 0
+        return self.version_key > other.version_key
 
     def __lt__(self, other):
         self._error_on_different_name(other)
-        return semver.compare(self.version, other.version) < 0
+        return self.version_key < other.version_key
 
     def __eq__(self, other):
         self._error_on_different_name(other)
-        return semver.compare(self.version, other.version) == 0
+        return self.version_key == other.version_key
 
     def __ne__(self, other):
         return not self.__eq__(other)
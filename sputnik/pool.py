@@ -1,10 +1,16 @@
 import os
+import io
+import time
 import shutil
 import logging
+from multiprocessing.pool import ThreadPool
 
 from . import util
+from . import default
 from .package import Package
 from .package_list import PackageList
+from .object_store import ObjectStore
+from .archive_reader import ArchiveReader
 
 
 class NotEnoughSpaceException(Exception): pass
@@ -15,9 +21,15 @@ class Pool(PackageList):
 
     package_class = Package
 
-    def __init__(self, app_name, app_version, path, **kwargs):
+    def __init__(self, app_name, app_version, path, dedup=False, **kwargs):
         super(Pool, self).__init__(app_name, app_version, path, **kwargs)
         self.logger = logging.getLogger(__name__)
+
+        # once created the object store is used by all later installs
+        self.objects = ObjectStore(os.path.join(self.path, default.OBJECTS_DIRNAME))
+        if dedup:
+            self.objects.create()
+
         self.cleanup()
 
     def cleanup(self):
@@ -26,24 +38,170 @@ class Pool(PackageList):
                 self.logger.info('remove %s', filename)
                 shutil.rmtree(os.path.join(self.path, filename))
 
-    def install(self, archive):
-        for pkg in self.find(archive.name):
+        # temporary files of interrupted lazy extractions, the ones still
+        # written to by other processes are kept
+        for pkg in self.find():
+            for filename in os.listdir(pkg.path):
+                path = os.path.join(pkg.path, filename)
+                if filename.endswith('.lazy') and \
+                        time.time() - os.path.getmtime(path) > default.LAZY_TMP_AGE:
+                    self.logger.info('remove %s', path)
+                    os.remove(path)
+
+    def lazy_packages(self):
+        return [pkg for pkg in self.find() if pkg.meta.get('lazy')]
+
+    # files of installed versions by (checksum, size)
+    def installed_files(self, packages):
+        res = {}
+        for pkg in packages:
+            for entry in pkg.manifest:
+                key = (tuple(entry['checksum']), entry['size'])
+                res[key] = os.path.join(pkg.path, *entry['path'])
+        return res
+
+    def install(self, archive, workers=None, lazy=False):
+        installed = self.find(archive.name)
+        for pkg in installed:
             if archive.ident == pkg.ident:
                 raise PackageAlreadyInstalledException(pkg.ident)
 
-        if not util.is_enough_space(self.path, archive.archive.size()):
-            raise NotEnoughSpaceException('requires %0.2f MB' %
-                                          (archive.archive.size() / 1024 / 1024))
+        archive_name = util.archive_filename(archive.name, archive.version)
+        path = os.path.join(self.path, archive_name)
+
+        if lazy:
+            self.install_lazy(archive, path)
+        else:
+            self.install_files(archive, path, installed, workers=workers)
 
         # remove installed versions of same package
-        for pkg in self.find(archive.name):
+        for pkg in installed:
             self.remove(pkg)
 
-        archive_name = util.archive_filename(archive.name, archive.version)
-        path = os.path.join(self.path, archive_name)
+        # the registry is updated right away, the directory mtime might
+        # not have changed yet
+        self.load(refresh=[archive_name])
+        return path
+
+    # only meta.json is written, files are extracted from the archive on
+    # first access, so the archive has to stay in place
+    def install_lazy(self, archive, path):
+        if not isinstance(archive.archive, ArchiveReader):
+            raise Exception('lazy install requires an archive file: %s' % archive.path)
+
+        meta = dict(archive.archive.meta)
+        meta['lazy'] = os.path.abspath(archive.archive.path)
+
+        self.logger.info('install %s (lazy)', os.path.basename(path))
+        util.write_meta(path + '.tmp', meta)
+        os.rename(path + '.tmp', path)
+
+    def install_files(self, archive, path, installed, workers=None):
+        # files unchanged since an installed version are linked, only
+        # changed files are extracted
+        files = self.installed_files(installed)
+        dedup = self.objects.exists()
+        reuse, members = [], []
+        for info in archive.archive.members:
+            src = dedup and self.objects.get(info.checksum, info.size) or \
+                files.get((info.checksum, info.size))
+            if src and os.path.isfile(src) and os.path.getsize(src) == info.size:
+                reuse.append((src, info))
+            else:
+                members.append(info.path)
+
+        size = archive.archive.size() - sum(info.size for _, info in reuse)
+        if not util.is_enough_space(self.path, size):
+            raise NotEnoughSpaceException('requires %0.2f MB' %
+                                          (size / 1024 / 1024))
 
         self.logger.info('install %s', os.path.basename(path))
-        archive.archive.extract_all(path + '.tmp')
+        for src, info in reuse:
+            util.link_or_copy(src, os.path.join(path + '.tmp', *info.path))
+        archive.archive.extract_all(path + '.tmp', workers=workers,
+                                    members=members)
+
+        if dedup:
+            for info in archive.archive.members:
+                self.objects.add(os.path.join(path + '.tmp', *info.path),
+                                 info.checksum)
+
+        util.write_meta(path + '.tmp', archive.archive.meta)
         os.rename(path + '.tmp', path)
 
-        return path
+    # rehashes installed files and returns the corrupted ones by package,
+    # fast mode skips files unchanged since they were last verified
+    def verify(self, package_string=None, workers=None, fast=False):
+        # kept next to the registry, so writing it does not change the
+        # mtime of the pool directory
+        state_path = os.path.join(self.path, default.REGISTRY_DIRNAME,
+                                  default.VERIFY_FILENAME)
+        state = {}
+        if fast and os.path.isfile(state_path):
+            try:
+                state = util.json_load(state_path)
+            except ValueError:
+                self.logger.warning('ignore invalid state %s', state_path)
+
+        files = []
+        for pkg in self.find(package_string):
+            lazy = pkg.meta.get('lazy')
+            for entry in pkg.manifest:
+                path = os.path.join(pkg.path, *entry['path'])
+                if lazy and not os.path.exists(path):
+                    continue  # not extracted yet
+                files.append((pkg.ident, path, entry))
+
+        def check(item):
+            ident, path, entry = item
+            try:
+                st = os.stat(path)
+            except OSError:
+                return ident, path, entry, None
+            key = [st.st_size, st.st_mtime, st.st_ino, entry['checksum'][1]]
+            if st.st_size != entry['size']:
+                return ident, path, entry, None
+            if state.get(path) == key:
+                return ident, path, entry, key
+            checksum = util.file_checksum(path, entry['checksum'][0],
+                                          default.VERIFY_CHUNK_SIZE)
+            if checksum != entry['checksum'][1]:
+                return ident, path, entry, None
+            return ident, path, entry, key
+
+        res = {}
+        pool = ThreadPool(workers or default.VERIFY_WORKERS)
+        try:
+            for ident, path, entry, key in pool.imap_unordered(check, files):
+                res.setdefault(ident, [])
+                if key is None:
+                    self.logger.warning('corrupted %s', path)
+                    res[ident].append(util.get_path(*entry['path']))
+                    state.pop(path, None)
+                else:
+                    state[path] = key
+        finally:
+            pool.close()
+            pool.join()
+
+        # forget files of removed packages
+        installed = set(os.path.basename(pkg.path) for pkg in self.find())
+        state = dict((path, key) for path, key in state.items()
+                     if os.path.relpath(path, self.path).split(os.path.sep)[0] in installed)
+        tmp = '%s.%d' % (state_path, os.getpid())
+        try:
+            util.makedirs(state_path)
+            with io.open(tmp, 'wb') as f:
+                f.write(util.json_dump(state))
+            os.rename(tmp, state_path)
+        except (IOError, OSError) as e:  # read-only data path
+            self.logger.info('cannot write state %s: %s', state_path, e)
+
+        for corrupted in res.values():
+            corrupted.sort()
+        return res
+
+    def remove(self, package):
+        super(Pool, self).remove(package)
+        if self.objects.exists():
+            self.objects.collect()
@@ -25,6 +25,10 @@ class Recipe(PackageStub):  # package archive
         self.base_path = base_path or recipe_path
 
         self.include = defaults.get('include')
+        self.codec = defaults.get('codec')
+        self.compresslevel = defaults.get('compresslevel')
+        self.block_size = defaults.get('block_size')
+        self.checksum_name = defaults.get('checksum')
         self.is_valid(True)
 
     def is_valid(self, raise_exception=False):
@@ -37,18 +41,26 @@ class Recipe(PackageStub):  # package archive
                     return False
         return True
 
-    def build(self, archive_path):
+    def build(self, archive_path, workers=None, threads=None, previous=None):
         if os.path.isdir(archive_path):
             filename = util.archive_filename(self.name, self.version, suffix=True)
             archive_path = os.path.join(archive_path, filename)
 
-        archive = ArchiveWriter(archive_path, base_path=self.base_path)
+        archive = ArchiveWriter(archive_path, base_path=self.base_path,
+                                codec=self.codec,
+                                compresslevel=self.compresslevel,
+                                block_size=self.block_size,
+                                threads=threads,
+                                checksum_name=self.checksum_name,
+                                previous=previous)
         self.logger.info("build %s", archive.path)
 
+        paths = []
         for include in self.include:
             for path in glob(os.path.join(self.recipe_path, os.path.sep.join(include))):
                 if os.path.isfile(path):
-                    archive.add(path)
+                    paths.append(path)
+        archive.add_all(paths, workers=workers)
         archive.add_json('package', self.to_dict())
         archive.close()
 
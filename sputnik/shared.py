@@ -0,0 +1,174 @@
+import os
+import io
+import re
+import struct
+import hashlib
+import tempfile
+import contextlib
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+
+class SharedMemoryNotSupportedException(Exception): pass
+
+
+# ready flag, padded so data stays aligned
+HEADER = struct.Struct('<Q')
+HEADER_SIZE = 64
+
+
+def segment_name(ident, checksum):
+    # macos limits shared memory names to 31 characters
+    key = '%s:%s:%s' % (ident, checksum[0], checksum[1])
+    return 'sputnik_' + hashlib.sha1(key.encode('utf8')).hexdigest()[:20]
+
+
+def lock_path(name):
+    return os.path.join(tempfile.gettempdir(), name + '.lock')
+
+
+@contextlib.contextmanager
+def locked():
+    # one lock for all segments serializes attach and detach across
+    # processes, windows frees segments with their last handle instead
+    if fcntl is None:
+        yield
+        return
+
+    with io.open(lock_path('sputnik_shared'), 'ab') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def open_segment(name, size=0, create=False):
+    try:
+        shm = shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    except TypeError:  # python < 3.13 always tracks
+        shm = shared_memory.SharedMemory(name, create=create, size=size)
+        # the tracker would unlink the segment when this process exits,
+        # segments are freed by their last user instead
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        shm.untracked = True
+    return shm
+
+
+def unlink_segment(shm):
+    # unlink() unregisters from the tracker again on python < 3.13
+    if getattr(shm, 'untracked', False):
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+# holds a shared lock on the segment's lock file, the kernel releases it
+# when the process exits, so a successful exclusive lock means there are
+# no users left; call with locked()
+def is_unused(f):
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def remove(name):
+    try:
+        shm = open_segment(name)
+    except FileNotFoundError:
+        pass
+    else:
+        shm.close()
+        unlink_segment(shm)
+    os.remove(lock_path(name))
+
+
+# removes segments left behind by processes that all exited without
+# close(), returns the number of removed segments
+def collect():
+    if shared_memory is None or fcntl is None:
+        return 0
+
+    removed = 0
+    with locked():
+        for filename in os.listdir(tempfile.gettempdir()):
+            m = re.match(r'(sputnik_[0-9a-f]{20})\.lock$', filename)
+            if not m:
+                continue
+            with io.open(lock_path(m.group(1)), 'ab') as f:
+                if is_unused(f):
+                    remove(m.group(1))
+                    removed += 1
+    return removed
+
+
+class SharedMember(object):
+    # file contents loaded once per host into shared memory, processes
+    # attaching to the same name share it until the last one detaches or
+    # exits; views derived from buf have to be released before close()
+
+    def __init__(self, name, filename, size):
+        if shared_memory is None:
+            raise SharedMemoryNotSupportedException('shared memory requires python >= 3.8')
+
+        self.name = name
+        self.lock = None
+        with locked():
+            if fcntl is not None:
+                self.lock = io.open(lock_path(name), 'ab')
+                fcntl.flock(self.lock.fileno(), fcntl.LOCK_SH)
+            self.shm = self.attach(filename, size)
+        self.buf = self.shm.buf[HEADER_SIZE:HEADER_SIZE + size]
+
+    def attach(self, filename, size):
+        try:
+            shm = open_segment(self.name)
+            if HEADER.unpack_from(shm.buf)[0]:
+                return shm
+
+            # a process died while loading the segment
+            shm.close()
+            unlink_segment(shm)
+        except FileNotFoundError:
+            pass
+
+        shm = open_segment(self.name, HEADER_SIZE + size, create=True)
+        with io.open(filename, 'rb') as f:
+            view = shm.buf[HEADER_SIZE:HEADER_SIZE + size]
+            try:
+                n = 0
+                while n < size:
+                    read = f.readinto(view[n:])
+                    if not read:
+                        raise Exception('file changed while loading: %s' % filename)
+                    n += read
+            finally:
+                view.release()
+        HEADER.pack_into(shm.buf, 0, 1)
+        return shm
+
+    def close(self):
+        if self.shm is None:
+            return
+
+        self.buf.release()
+        self.shm.close()
+        with locked():
+            if self.lock is not None:
+                if is_unused(self.lock):
+                    remove(self.name)
+                self.lock.close()
+        self.shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 import io
 import os
+import shutil
 import tempfile
 import json
 
@@ -47,6 +48,27 @@ def sample_package_path2():
     return sample_package_path('2.0.0')
 
 
+# copies of the sample package with other package.json fields and
+# optionally other file contents by path relative to the package
+@pytest.fixture
+def sample_package_variant(sample_package_path):
+    def variant(fields, files=None):
+        path = os.path.join(tempfile.mkdtemp(), 'package')
+        shutil.copytree(sample_package_path, path)
+
+        meta_path = os.path.join(path, 'package.json')
+        defaults = util.json_load(meta_path)
+        defaults.update(fields)
+        with io.open(meta_path, 'wb') as f:
+            f.write(util.json_dump(defaults))
+
+        for filename, data in (files or {}).items():
+            with io.open(os.path.join(path, filename), 'wb') as f:
+                f.write(data)
+        return path
+    return variant
+
+
 def pytest_addoption(parser):
     parser.addoption("--remote", action="store_true",
         help="include tests that require internet connectivity")
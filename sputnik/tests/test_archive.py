@@ -1,14 +1,22 @@
 import os
+import sys
+import errno
 import tarfile
 import hashlib
 import io
+import gzip
+import zlib
+import shutil
 
 import pytest
 
 from ..archive_writer import ArchiveWriter, InvalidPathException,\
                              EmptyArchiveException
-from ..archive_reader import ArchiveReader
+from ..archive_reader import ArchiveReader, StreamArchiveReader,\
+                             MemberNotFoundException
 from ..default import ARCHIVE_FILENAME, META_FILENAME
+from .. import compression
+from ..util import UnknownChecksumException
 
 
 def path_content(path, base_path=None):
@@ -142,3 +150,397 @@ def test_create_abspath_without_base_path(tmp_path, sample_package_path):
     assert not os.path.exists(archive_path)
     assert os.path.exists(tmp_path)
     assert len(os.listdir(tmp_path)) == 0
+
+
+def test_create_and_extract_parallel(tmp_path, sample_package_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    f = ArchiveWriter(archive_path, base_path=sample_package_path)
+    f.add_path(sample_package_path)
+    f.close()
+
+    sequential_path = os.path.join(tmp_path, 'sequential')
+    parallel_path = os.path.join(tmp_path, 'parallel')
+
+    with ArchiveReader(archive_path) as archive:
+        archive.extract_all(sequential_path, workers=1)
+
+    progress = []
+    with ArchiveReader(archive_path) as archive:
+        archive.extract_all(parallel_path, cb=progress.append, workers=4)
+
+    assert progress
+    assert set(path_content(sequential_path)) == set(path_content(parallel_path))
+    for path in path_content(sequential_path):
+        with io.open(os.path.join(sequential_path, *path), 'rb') as f1:
+            with io.open(os.path.join(parallel_path, *path), 'rb') as f2:
+                assert f1.read() == f2.read()
+
+
+def test_extract_parallel_checksum_mismatch(tmp_path, sample_package_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    f = ArchiveWriter(archive_path, base_path=sample_package_path)
+    f.add_path(sample_package_path)
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        archive.meta['manifest'][0]['checksum'] = ('md5', '0' * 32)
+        archive.load_index()
+        with pytest.raises(Exception):
+            archive.extract_all(os.path.join(tmp_path, 'extract'), workers=4)
+
+
+def test_create_and_read_member(tmp_path, sample_package_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    f = ArchiveWriter(archive_path, base_path=sample_package_path)
+    f.add_path(sample_package_path)
+    f.close()
+
+    with io.open(os.path.join(sample_package_path, 'data', 'xyz.model'), 'rb') as f:
+        data = f.read()
+
+    with ArchiveReader(archive_path) as archive:
+        info = archive.get_member_info(('data', 'xyz.model'))
+        assert info.size == len(data)
+        assert info.checksum[1] == hashlib.md5(data).hexdigest()
+
+        with archive.open_member(['data', 'xyz.model']) as f:
+            assert f.read() == data
+
+        assert archive.read_member(('data', 'xyz.model')) == data
+        assert archive.read_member(('data', 'xyz.model'), 100, 10) == data[100:110]
+        assert archive.read_member(('data', 'xyz.model'), len(data) - 5) == data[-5:]
+
+        with pytest.raises(MemberNotFoundException):
+            archive.read_member(('data', 'foo'))
+
+
+class Pipe(object):
+    def __init__(self, path):
+        self.f = io.open(path, 'rb')
+
+    def read(self, size=-1):
+        return self.f.read(size)
+
+
+def test_create_and_extract_stream(tmp_path, sample_package_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    f = ArchiveWriter(archive_path, base_path=sample_package_path)
+    f.add_path(sample_package_path)
+    f.close()
+
+    tar = tarfile.open(archive_path, 'r')
+    assert tar.getnames() == [META_FILENAME, ARCHIVE_FILENAME]
+
+    # archives of older versions stored archive.gz before meta.json
+    legacy_path = os.path.join(tmp_path, 'legacy.sputnik')
+    legacy = tarfile.open(legacy_path, 'w')
+    for name in [ARCHIVE_FILENAME, META_FILENAME]:
+        legacy.addfile(tar.getmember(name), tar.extractfile(name))
+    legacy.close()
+
+    for path in [archive_path, legacy_path]:
+        extract_path = os.path.join(tmp_path, os.path.basename(path) + '.d')
+        with StreamArchiveReader(Pipe(path)) as archive:
+            archive.extract_all(extract_path)
+
+        assert set(path_content(extract_path)) == \
+               set(path_content(sample_package_path)) | set([(META_FILENAME,)])
+        for path in path_content(sample_package_path):
+            with io.open(os.path.join(sample_package_path, *path), 'rb') as f1:
+                with io.open(os.path.join(extract_path, *path), 'rb') as f2:
+                    assert f1.read() == f2.read()
+
+
+def test_create_stored_and_extract(tmp_path, sample_package_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    random_path = os.path.join(tmp_path, 'data', 'random.bin')
+    os.makedirs(os.path.dirname(random_path))
+    with io.open(random_path, 'wb') as f:
+        f.write(os.urandom(1024 * 100))
+
+    for filename in ['xyz.model', 'xyz.json']:
+        shutil.copy(os.path.join(sample_package_path, 'data', filename),
+                    os.path.join(tmp_path, 'data'))
+
+    f = ArchiveWriter(archive_path, base_path=tmp_path, codec='auto')
+    f.add(random_path)
+    f.add(os.path.join(tmp_path, 'data', 'xyz.model'))
+    f.add(os.path.join(tmp_path, 'data', 'xyz.json'), codec='stored')
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        codecs = [e['codec'] for e in archive.meta['manifest']]
+        assert codecs == ['stored', 'gzip', 'stored']
+
+        with io.open(random_path, 'rb') as f:
+            data = f.read()
+        assert archive.read_member(('data', 'random.bin')) == data
+        assert archive.read_member(('data', 'random.bin'), 1000, 10) == data[1000:1010]
+        with archive.open_member(('data', 'random.bin')) as f:
+            assert f.read() == data
+
+        archive.extract(['data', 'random.bin'], os.path.join(tmp_path, 'extract'))
+        with io.open(os.path.join(tmp_path, 'extract', 'data', 'random.bin'), 'rb') as f:
+            assert f.read() == data
+
+
+@pytest.mark.parametrize('copy', ['kernel', 'plain', 'sendfile_error'])
+def test_extract_large_members(tmp_path, monkeypatch, copy):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+    os.makedirs(os.path.join(tmp_path, 'data'))
+
+    data = os.urandom(1024 * 1024) * 3
+    for codec in ['stored', 'gzip']:
+        with io.open(os.path.join(tmp_path, 'data', codec), 'wb') as f:
+            f.write(data)
+
+    f = ArchiveWriter(archive_path, base_path=tmp_path)
+    for codec in ['stored', 'gzip']:
+        f.add(os.path.join(tmp_path, 'data', codec), codec=codec)
+    f.close()
+
+    if copy != 'kernel':
+        monkeypatch.delattr(os, 'copy_file_range', raising=False)
+        monkeypatch.delattr(os, 'sendfile', raising=False)
+    if copy == 'sendfile_error':
+        # sendfile to regular files on macos and freebsd
+        def sendfile(out_fd, in_fd, offset, count):
+            raise OSError(errno.ENOTSOCK, os.strerror(errno.ENOTSOCK))
+        monkeypatch.setattr(os, 'sendfile', sendfile, raising=False)
+        monkeypatch.setattr(sys, 'platform', 'linux')
+
+    progress = []
+    extract_path = os.path.join(tmp_path, 'extract')
+    with ArchiveReader(archive_path) as archive:
+        archive.extract_all(extract_path, cb=progress.append)
+
+    for codec in ['stored', 'gzip']:
+        with io.open(os.path.join(extract_path, 'data', codec), 'rb') as f:
+            assert f.read() == data
+    assert progress.count(len(data)) == 2
+
+
+@pytest.mark.parametrize('codec', sorted(compression.codecs))
+def test_create_with_codec_and_extract(tmp_path, sample_package_path, codec):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    f = ArchiveWriter(archive_path, base_path=sample_package_path,
+                      codec=codec, compresslevel=1)
+    f.add_path(sample_package_path)
+    f.close()
+
+    extract_path = os.path.join(tmp_path, 'extract')
+    with ArchiveReader(archive_path) as archive:
+        assert set(e['codec'] for e in archive.meta['manifest']) == set([codec])
+        archive.extract_all(extract_path)
+
+        for path in path_content(sample_package_path):
+            with io.open(os.path.join(sample_package_path, *path), 'rb') as f:
+                data = f.read()
+            with io.open(os.path.join(extract_path, *path), 'rb') as f:
+                assert f.read() == data
+            assert archive.read_member(path, 10, 20) == data[10:30]
+
+
+def test_create_with_unknown_codec(tmp_path, sample_package_path):
+    f = ArchiveWriter(os.path.join(tmp_path, 'test.sputnik'),
+                      base_path=sample_package_path, codec='foo')
+    with pytest.raises(compression.UnknownCodecException):
+        f.add_path(sample_package_path)
+    f.cleanup()
+
+
+def test_create_blocked_and_extract(tmp_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    path = os.path.join(tmp_path, 'data', 'vectors.bin')
+    os.makedirs(os.path.dirname(path))
+    with io.open(path, 'wb') as f:
+        data = b''.join(('%08d' % i).encode('ascii') for i in range(10000))
+        f.write(data)
+
+    f = ArchiveWriter(archive_path, base_path=tmp_path, block_size=7000)
+    f.add(path)
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        entry = archive.meta['manifest'][0]
+        assert entry['block_size'] == 7000
+        assert len(entry['blocks']) == 12
+
+        assert archive.read_member(('data', 'vectors.bin')) == data
+        assert archive.read_member(('data', 'vectors.bin'), 6990, 20) == data[6990:7010]
+        assert archive.read_member(('data', 'vectors.bin'), 70000, 100) == data[70000:70100]
+        assert archive.read_member(('data', 'vectors.bin'), 79990) == data[79990:]
+
+        for workers in [1, 4]:
+            extract_path = os.path.join(tmp_path, 'extract%d' % workers)
+            progress = []
+            archive.extract_all(extract_path, cb=progress.append, workers=workers)
+            assert max(progress) == len(data)
+            with io.open(os.path.join(extract_path, 'data', 'vectors.bin'), 'rb') as f:
+                assert f.read() == data
+
+    # blocks are concatenated gzip members, plain gzip readers still work
+    with ArchiveReader(archive_path) as archive:
+        info = archive.get_member_info(('data', 'vectors.bin'))
+        archive.archive.seek(info.start)
+        compressed = io.BytesIO(archive.archive.read(info.end - info.start))
+        assert gzip.GzipFile(fileobj=compressed).read() == data
+
+
+def test_create_parallel_identical(tmp_path, sample_package_path):
+    path = os.path.join(tmp_path, 'package', 'data', 'vectors.bin')
+    os.makedirs(os.path.dirname(path))
+    with io.open(path, 'wb') as f:
+        f.write(b''.join(('%08d' % i).encode('ascii') for i in range(10000)))
+    for filename in ['xyz.model', 'xyz.json']:
+        shutil.copy(os.path.join(sample_package_path, 'data', filename),
+                    os.path.dirname(path))
+
+    results = []
+    for workers in [1, 4]:
+        archive_path = os.path.join(tmp_path, 'test%d.sputnik' % workers)
+        f = ArchiveWriter(archive_path, base_path=os.path.join(tmp_path, 'package'),
+                          block_size=7000)
+        f.add_path(os.path.join(tmp_path, 'package'), workers=workers)
+        f.close()
+
+        with ArchiveReader(archive_path) as archive:
+            results.append((archive.meta, archive.archive.read()))
+
+    assert results[0] == results[1]
+
+
+def test_create_parallel_bounded(tmp_path):
+    path = os.path.join(tmp_path, 'package')
+    os.makedirs(path)
+    for i in range(50):
+        with io.open(os.path.join(path, '%d.bin' % i), 'wb') as f:
+            f.write(os.urandom(1024))
+
+    f = ArchiveWriter(os.path.join(tmp_path, 'test.sputnik'), base_path=path)
+
+    # temporary members waiting to be appended
+    members = []
+    append_entry = f.append_entry
+    def spy(entry, base):
+        members.append(len([m for m in os.listdir(f.tmp_path) if m.endswith('.member')]))
+        return append_entry(entry, base)
+    f.append_entry = spy
+
+    f.add_path(path, workers=2)
+    f.close()
+    assert len(members) == 50
+    assert max(members) <= 4
+
+
+def test_create_threaded_and_extract(tmp_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    path = os.path.join(tmp_path, 'data', 'vectors.bin')
+    os.makedirs(os.path.dirname(path))
+    with io.open(path, 'wb') as f:
+        data = b''.join(('%08d' % i).encode('ascii') for i in range(500000))
+        f.write(data)
+
+    f = ArchiveWriter(archive_path, base_path=tmp_path, threads=4)
+    f.add(path)
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        entry = archive.meta['manifest'][0]
+        assert entry['checksum'][1] == hashlib.md5(data).hexdigest()
+        assert archive.read_member(('data', 'vectors.bin')) == data
+
+        archive.extract_all(os.path.join(tmp_path, 'extract'))
+        with io.open(os.path.join(tmp_path, 'extract', 'data', 'vectors.bin'), 'rb') as f:
+            assert f.read() == data
+
+        # a single valid gzip stream
+        archive.archive.seek(0)
+        compressed = archive.archive.read(entry['noffset'])
+        assert zlib.decompress(compressed, 16 + zlib.MAX_WBITS) == data
+        assert gzip.GzipFile(fileobj=io.BytesIO(compressed)).read() == data
+
+
+def test_create_archive_checksum(tmp_path, sample_package_path):
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    f = ArchiveWriter(archive_path, base_path=sample_package_path)
+    f.add_path(sample_package_path, workers=2)
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        assert archive.meta['archive'][0] == ARCHIVE_FILENAME
+        assert archive.meta['archive'][1] == hashlib.md5(archive.archive.read()).hexdigest()
+
+
+@pytest.mark.parametrize('checksum_name', ['md5', 'sha256', 'blake2b', 'xxh64'])
+def test_create_with_checksum_and_extract(tmp_path, sample_package_path, checksum_name):
+    if checksum_name.startswith('xxh'):
+        pytest.importorskip('xxhash')
+
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+
+    f = ArchiveWriter(archive_path, base_path=sample_package_path,
+                      checksum_name=checksum_name)
+    f.add_path(sample_package_path)
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        assert archive.meta['checksum_name'] == checksum_name
+        assert set(e['checksum'][0] for e in archive.meta['manifest']) == set([checksum_name])
+        archive.extract_all(os.path.join(tmp_path, 'extract'))
+
+    with StreamArchiveReader(Pipe(archive_path)) as archive:
+        archive.extract_all(os.path.join(tmp_path, 'stream'))
+
+
+def test_create_with_unknown_checksum(tmp_path, sample_package_path):
+    with pytest.raises(UnknownChecksumException):
+        ArchiveWriter(os.path.join(tmp_path, 'test.sputnik'),
+                      base_path=sample_package_path, checksum_name='foo')
+
+
+def test_create_incremental(tmp_path, sample_package_path):
+    package_path = os.path.join(tmp_path, 'package')
+    shutil.copytree(os.path.join(sample_package_path, 'data'),
+                    os.path.join(package_path, 'data'))
+
+    archive_path = os.path.join(tmp_path, 'test.sputnik')
+    f = ArchiveWriter(archive_path, base_path=package_path, compresslevel=1)
+    f.add_path(package_path)
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        model_info = archive.get_member_info(('data', 'xyz.model'))
+        archive.archive.seek(model_info.start)
+        model_data = archive.archive.read(model_info.end - model_info.start)
+
+    with io.open(os.path.join(package_path, 'data', 'xyz.json'), 'wb') as f:
+        f.write(b'{"test": false}')
+
+    # rebuild in place, xyz.model keeps its level 1 compressed member
+    f = ArchiveWriter(archive_path, base_path=package_path, compresslevel=9,
+                      previous=archive_path)
+    f.add_path(package_path)
+    f.close()
+
+    with ArchiveReader(archive_path) as archive:
+        info = archive.get_member_info(('data', 'xyz.model'))
+        archive.archive.seek(info.start)
+        assert archive.archive.read(info.end - info.start) == model_data
+        assert archive.read_member(('data', 'xyz.json')) == b'{"test": false}'
+
+        extract_path = os.path.join(tmp_path, 'extract')
+        archive.extract_all(extract_path)
+        for path in path_content(package_path):
+            with io.open(os.path.join(package_path, *path), 'rb') as f1:
+                with io.open(os.path.join(extract_path, *path), 'rb') as f2:
+                    assert f1.read() == f2.read()
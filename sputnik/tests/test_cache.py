@@ -1,6 +1,16 @@
+import os
+import io
+import hashlib
+
 import pytest
 
+from .. import uget
+from .. import util
 from ..cache import Cache
+from ..pool import Pool
+from ..recipe import Recipe
+from ..archive import Archive
+from ..archive_reader import ArchiveReader
 from ..package_stub import PackageStub
 from ..package_list import (CompatiblePackageNotFoundException,
                             PackageNotFoundException)
@@ -27,6 +37,35 @@ def test_list(tmp_path):
     assert len(cache.find('abc>=1.9.0')) == 3
 
 
+def test_update_batched(tmp_path, monkeypatch):
+    cache = Cache('test', '1.0.0', tmp_path)
+    package = PackageStub({'name': 'abc', 'version': '1.0.0'})
+    cache.update({'archive': ['archive.gz', None], 'package': package.to_dict()},
+                 None, etag='1')
+    assert cache.get('abc').meta['etag'] == '1'
+
+    # updates in a loop reload once at the end
+    loads = []
+    load_registry = cache.load_registry
+    def counted(refresh=None):
+        loads.append(refresh)
+        return load_registry(refresh)
+    monkeypatch.setattr(cache, 'load_registry', counted)
+
+    updated = []
+    for i in range(1, 5):
+        package = PackageStub({'name': 'abc', 'version': '%d.0.0' % i})
+        cache.update({'archive': ['archive.gz', None], 'package': package.to_dict()},
+                     None, etag='2', reload=False)
+        updated.append(package.ident)
+    assert loads == []
+
+    cache.load(refresh=updated)
+    assert loads == [updated]
+    assert len(cache.find('abc')) == 4
+    assert cache.get('abc ==1.0.0').meta['etag'] == '2'
+
+
 def test_update(tmp_path):
     cache = Cache('test', '1.0.0', tmp_path)
     package = PackageStub({'name': 'abc', 'version': '1.0.0'})
@@ -185,3 +224,125 @@ def test_update_multiple_incompatible(tmp_path):
 
     with pytest.raises(PackageNotFoundException):
         assert cache.get('xyz')
+
+
+def test_fetch_pipelined(tmp_path, sample_package_path, monkeypatch):
+    archive = Recipe(sample_package_path).build(os.path.join(tmp_path, 'build.sputnik'))
+    with ArchiveReader(archive.path) as reader:
+        meta = reader.meta
+        data = reader.archive.read()
+
+    def read_request(session, url, offset=0, console=None,
+                     progress_func=None, write_func=None):
+        for i in range(offset, len(data), 100):
+            write_func(data[i:i + 100])
+
+        class Response(object):
+            headers = {util.s3_header('md5'): hashlib.md5(data).hexdigest()}
+        return Response()
+
+    monkeypatch.setattr(uget, 'read_request', read_request)
+
+    data_path = os.path.join(tmp_path, 'data')
+    os.mkdir(data_path)
+    cache = Cache('test', '1.0.0', data_path)
+    cache.update(meta, 'http://localhost/test-1.0.0/meta.json')
+
+    pool = Pool('test', '1.0.0', data_path)
+    path = pool.install(cache.fetch('test', pipelined=True))
+
+    # cached copy is kept to allow resuming
+    package = cache.get('test')
+    with io.open(os.path.join(package.path, 'archive.gz'), 'rb') as f:
+        assert f.read() == data
+
+    for entry in meta['manifest']:
+        with io.open(os.path.join(sample_package_path, *entry['path']), 'rb') as f1:
+            with io.open(os.path.join(path, *entry['path']), 'rb') as f2:
+                assert f1.read() == f2.read()
+    assert os.path.isfile(os.path.join(path, 'meta.json'))
+
+
+@pytest.mark.parametrize('ranges', [True, False])
+@pytest.mark.parametrize('pipelined', [False, True])
+@pytest.mark.parametrize('filename', ['xyz.json', 'xyz.model'])
+def test_fetch_delta(tmp_path, sample_package_path, sample_package_variant, monkeypatch,
+                     ranges, pipelined, filename):
+    archive1 = Recipe(sample_package_path).build(os.path.join(tmp_path, 'build1.sputnik'))
+
+    # xyz.model follows the reused xyz.json in the archive
+    package_path = sample_package_variant(
+        {'version': '2.0.0'}, {os.path.join('data', filename): b'{"test": false}'})
+    archive2 = Recipe(package_path).build(os.path.join(tmp_path, 'build2.sputnik'))
+
+    with ArchiveReader(archive1.path) as reader:
+        meta1, data1 = reader.meta, reader.archive.read()
+    with ArchiveReader(archive2.path) as reader:
+        meta2, data2 = reader.meta, reader.archive.read()
+        changed = reader.get_member_info(('data', filename))
+
+    requested = []
+
+    def read_range(session, url, offset, length, write_func=None):
+        requested.append((offset, length))
+        if not ranges:  # server ignores the range header
+            raise uget.UnsupportedHTTPCodeException(200)
+        write_func(data2[offset:offset + length])
+
+    def download(session, url, path, chunk_func=None, **kwargs):
+        with io.open(path, 'wb') as f:
+            for i in range(0, len(data2), 10):
+                f.write(data2[i:i + 10])
+                if chunk_func:
+                    chunk_func(data2[i:i + 10])
+
+    monkeypatch.setattr(uget, 'read_range', read_range)
+    monkeypatch.setattr(uget, 'download', download)
+
+    data_path = os.path.join(tmp_path, 'data')
+    os.mkdir(data_path)
+    cache = Cache('test', '1.0.0', data_path)
+    cache.update(meta1, 'http://localhost/test-1.0.0/meta.json')
+    cache.update(meta2, 'http://localhost/test-2.0.0/meta.json')
+
+    # previous version is cached already
+    with io.open(os.path.join(cache.get('test ==1.0.0').path, 'archive.gz'), 'wb') as f:
+        f.write(data1)
+
+    archive = cache.fetch('test ==2.0.0', pipelined=pipelined, delta=True)
+    if pipelined:
+        path = Pool('test', '1.0.0', data_path).install(archive)
+        for entry in meta2['manifest']:
+            with io.open(os.path.join(package_path, *entry['path']), 'rb') as f1:
+                with io.open(os.path.join(path, *entry['path']), 'rb') as f2:
+                    assert f1.read() == f2.read()
+
+    assert requested == [(changed.start, changed.end - changed.start)]
+    package = cache.get('test ==2.0.0')
+    with io.open(os.path.join(package.path, 'archive.gz'), 'rb') as f:
+        assert f.read() == data2
+    assert not os.path.exists(os.path.join(package.path, 'archive.gz.delta'))
+
+
+def test_purge_keeps_lazy_archives(tmp_path, sample_package_path):
+    archive = Recipe(sample_package_path).build(os.path.join(tmp_path, 'build.sputnik'))
+    with ArchiveReader(archive.path) as reader:
+        meta, data = reader.meta, reader.archive.read()
+
+    data_path = os.path.join(tmp_path, 'data')
+    os.mkdir(data_path)
+    cache = Cache('test', '1.0.0', data_path)
+    cache.update(meta, 'http://localhost/test-1.0.0/meta.json')
+    package = cache.get('test')
+    with io.open(os.path.join(package.path, 'archive.gz'), 'wb') as f:
+        f.write(data)
+
+    pool = Pool('test', '1.0.0', data_path)
+    pool.install(Archive(package.path), lazy=True)
+
+    cache.purge()
+    assert [p.ident for p in cache.find()] == [package.ident]
+
+    pool.purge()
+    cache.purge()
+    assert cache.find() == []
@@ -1,6 +1,9 @@
 import pytest
 
-from ..util import constraint_match
+import semver
+
+from ..util import constraint_match, constraint_range, parse_version, InvalidConstraintException
+from ..package_list import PackageList
 from ..package_stub import PackageStub
 
 
@@ -47,3 +50,56 @@ def test_no_version_match():
     assert not constraint_match(' <=1.0.0', '1.1.0')
     assert not constraint_match(' >1.0.0', '0.1.0')
     assert not constraint_match(' <1.0.0', '1.1.0')
+
+
+@pytest.mark.parametrize('constraint', [
+    '', '>=1.0.0', '>1.0.0', '<1.0.0', '<=1.0.0', '==1.0.0', '==1.5.0',
+    '>=0.1.0,<2.0.0', '>1.0.0 , <=2.0.0', '>=2.0.0,<1.0.0', '<0.0.1', '>=3.0.0',
+    '!=1.0.0', '>=1.0.0,!=1.1.0'])
+def test_constraint_range(constraint):
+    versions = ['0.1.0', '1.0.0-rc.1', '1.0.0', '1.0.1', '1.1.0', '2.0.0', '2.1.0']
+    keys = [parse_version(v) for v in versions]
+    bounds = constraint_range(constraint, keys)
+    if '!=' in constraint:
+        # excluded versions split the range
+        assert bounds is None
+    else:
+        assert versions[bounds[0]:bounds[1]] == \
+            [v for v in versions if constraint_match(constraint, v)]
+    assert [v for v in versions if constraint_match(constraint, v)] == \
+        [v for v in versions if all(semver.match(v, c.strip())
+                                    for c in constraint.split(',') if c.strip())]
+
+
+def test_parse_version_order():
+    versions = ['0.1.0', '1.0.0-alpha', '1.0.0-alpha.1', '1.0.0-alpha.beta',
+                '1.0.0-beta', '1.0.0-beta.2', '1.0.0-beta.11', '1.0.0-rc.1',
+                '1.0.0', '1.0.1', '1.10.0', '2.0.0']
+    for a in versions:
+        for b in versions:
+            assert (parse_version(a) > parse_version(b)) - \
+                (parse_version(a) < parse_version(b)) == semver.compare(a, b)
+
+
+class StubList(PackageList):
+    def packages(self, refresh=None):
+        for version in ['0.1.0', '1.0.0', '1.0.1', '1.1.0', '2.0.0']:
+            package = PackageStub({'name': 'test', 'version': version})
+            package.path = 'test-' + version
+            yield package
+
+
+@pytest.mark.parametrize('package_string,expected', [
+    ('test>=1.0.0,<2.0.0', ['1.0.0', '1.0.1', '1.1.0']),
+    ('test!=1.0.1', ['0.1.0', '1.0.0', '1.1.0', '2.0.0']),
+    ('test>=1.0.0,!=1.0.1,<2.0.0', ['1.0.0', '1.1.0'])])
+def test_package_list_find(package_string, expected):
+    package_list = StubList.__new__(StubList)
+    package_list.load()
+    assert [p.version for p in package_list.find(package_string)] == expected
+
+
+@pytest.mark.parametrize('constraint', ['=1.0.0', '!1.0.0', '=>1.0.0', '~1.0.0'])
+def test_invalid_constraint(constraint):
+    with pytest.raises(InvalidConstraintException):
+        constraint_match(constraint, '1.0.0')
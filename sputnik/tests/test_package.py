@@ -1,13 +1,18 @@
 import os
+import io
 import json
+import threading
+import multiprocessing
 
 import pytest
 
+from .. import util
 from ..recipe import Recipe
-from ..package import Package, NotIncludedException
+from ..package import Package, NotIncludedException, ArchiveNotFoundException
 from ..archive import Archive
 from ..pool import Pool
 from ..dir_package import DirPackage
+from .. import shared
 
 
 def test_build_and_check_archive(tmp_path, sample_package_path):
@@ -126,3 +131,308 @@ def test_dir_package(sample_package_path):
 
     with package.open(['data', 'xyz.json'], mode='rb', encoding=None) as f:
         assert f.read() == json.dumps({'test': True}).encode('ascii') == b'{"test": true}'
+
+
+def test_package_mmap(tmp_path, sample_package_path):
+    recipe = Recipe(sample_package_path)
+    archive = Archive(recipe.build(tmp_path).path)
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    package = Package(path=pool.install(archive))
+
+    m = package.mmap('data', 'xyz.model')
+    with io.open(package.file_path('data', 'xyz.model'), 'rb') as f:
+        assert m[:] == f.read()
+    with pytest.raises(TypeError):
+        m[0] = b'x'
+    m.close()
+
+    with pytest.raises(NotIncludedException):
+        package.mmap('data', 'model')
+
+    os.mkdir(os.path.join(tmp_path, 'empty'))
+    io.open(os.path.join(tmp_path, 'empty', 'empty.bin'), 'wb').close()
+    m = DirPackage(os.path.join(tmp_path, 'empty')).mmap('empty.bin')
+    assert len(m) == 0 and m[:] == b''
+
+
+def test_package_load_npy(tmp_path):
+    numpy = pytest.importorskip('numpy')
+
+    os.mkdir(os.path.join(tmp_path, 'data'))
+    numpy.save(os.path.join(tmp_path, 'data', 'vectors.npy'), numpy.arange(10))
+    package = DirPackage(tmp_path)
+
+    vectors = package.load_npy('data', 'vectors.npy')
+    assert isinstance(vectors, numpy.memmap)
+    assert list(vectors) == list(range(10))
+
+
+def test_package_upgrade_reuses_files(tmp_path, sample_package_path, sample_package_variant, monkeypatch):
+    archive1 = Recipe(sample_package_path).build(tmp_path)
+
+    package_path = sample_package_variant(
+        {'version': '2.0.0'}, {os.path.join('data', 'xyz.json'): b'{"test": false}'})
+    archive2 = Recipe(package_path).build(tmp_path)
+
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    pool.install(Archive(archive1.path))
+
+    linked = []
+    link_or_copy = util.link_or_copy
+    def spy(src, dst):
+        linked.append(os.path.relpath(dst, path + '.tmp'))
+        link_or_copy(src, dst)
+    path = os.path.join(pool.path, archive2.ident)
+    monkeypatch.setattr(util, 'link_or_copy', spy)
+
+    package = Package(path=pool.install(Archive(archive2.path)))
+    assert linked == [os.path.join('data', 'xyz.model')]
+    assert [p.ident for p in pool.find()] == [package.ident]
+
+    with package.open(['data', 'xyz.json']) as f:
+        assert json.load(f) == {'test': False}
+    with io.open(package.file_path('data', 'xyz.model'), 'rb') as f1:
+        with io.open(os.path.join(sample_package_path, 'data', 'xyz.model'), 'rb') as f2:
+            assert f1.read() == f2.read()
+
+
+def test_pool_dedup(tmp_path, sample_package_path, sample_package_variant):
+    archive1 = Recipe(sample_package_path).build(tmp_path)
+
+    package_path = sample_package_variant({'name': 'other'})
+    archive2 = Recipe(package_path).build(tmp_path)
+
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'), dedup=True)
+    package1 = Package(path=pool.install(Archive(archive1.path)))
+    package2 = Package(path=pool.install(Archive(archive2.path)))
+
+    objects = pool.objects
+    for entry in package1.manifest:
+        obj = objects.object_path(entry['checksum'])
+        assert os.path.samefile(obj, package1.file_path(*entry['path']))
+        assert os.path.samefile(obj, package2.file_path(*entry['path']))
+
+    pool.remove(package1)
+    for entry in package2.manifest:
+        assert os.path.isfile(objects.object_path(entry['checksum']))
+    with package2.open(['data', 'xyz.json']) as f:
+        assert json.load(f) == {'test': True}
+
+    pool.purge()
+    assert not [f for _, _, files in os.walk(objects.path) for f in files]
+
+
+def test_pool_dedup_corrupted(tmp_path, sample_package_path, sample_package_variant):
+    archive1 = Recipe(sample_package_path).build(tmp_path)
+    archive2 = Recipe(sample_package_variant({'name': 'other'})).build(tmp_path)
+
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'), dedup=True)
+    package1 = Package(path=pool.install(Archive(archive1.path)))
+
+    # truncated object, shared with the first package
+    entry = [e for e in package1.manifest if e['path'] == ['data', 'xyz.model']][0]
+    obj = pool.objects.object_path(entry['checksum'])
+    with io.open(obj, 'r+b') as f:
+        f.truncate(10)
+
+    package2 = Package(path=pool.install(Archive(archive2.path)))
+    filename = package2.file_path('data', 'xyz.model')
+    with io.open(filename, 'rb') as f:
+        assert f.read() == b'0' * 1024
+    assert os.path.samefile(obj, filename)
+
+
+def test_package_lazy_install(tmp_path, sample_package_path):
+    archive = Recipe(sample_package_path).build(tmp_path)
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    package = Package(path=pool.install(Archive(archive.path), lazy=True))
+    assert [p.ident for p in pool.find()] == [package.ident]
+
+    filename = os.path.join(package.path, 'data', 'xyz.model')
+    assert not os.path.exists(filename)
+
+    assert package.file_path('data', 'xyz.model') == filename
+    with io.open(filename, 'rb') as f1:
+        with io.open(os.path.join(sample_package_path, 'data', 'xyz.model'), 'rb') as f2:
+            assert f1.read() == f2.read()
+    with package.open(['data', 'xyz.json']) as f:
+        assert json.load(f) == {'test': True}
+    assert not [f for _, _, files in os.walk(package.path)
+                for f in files if f.endswith('.lazy')]
+
+
+def test_package_lazy_install_archive_removed(tmp_path, sample_package_path):
+    archive = Recipe(sample_package_path).build(tmp_path)
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    package = Package(path=pool.install(Archive(archive.path), lazy=True))
+
+    os.remove(archive.path)
+    with pytest.raises(ArchiveNotFoundException) as e:
+        package.file_path('data', 'xyz.model')
+    assert archive.path in str(e.value)
+
+
+def test_pool_cleanup_lazy(tmp_path, sample_package_path):
+    archive = Recipe(sample_package_path).build(tmp_path)
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    package = Package(path=pool.install(Archive(archive.path), lazy=True))
+
+    # left behind by an interrupted extraction and one still running
+    stale = os.path.join(package.path, 'xyz.model.abc.lazy')
+    running = os.path.join(package.path, 'xyz.model.def.lazy')
+    for path in [stale, running]:
+        with io.open(path, 'wb') as f:
+            f.write(b'0')
+    mtime = os.path.getmtime(stale) - 3600
+    os.utime(stale, (mtime, mtime))
+
+    Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    assert not os.path.exists(stale)
+    assert os.path.exists(running)
+
+
+def test_package_shared_memory(tmp_path, sample_package_path):
+    if shared.shared_memory is None:
+        pytest.skip('shared memory not supported')
+
+    archive = Recipe(sample_package_path).build(tmp_path)
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    package = Package(path=pool.install(Archive(archive.path)))
+    with io.open(package.file_path('data', 'xyz.model'), 'rb') as f:
+        data = f.read()
+
+    with package.shared_memory('data', 'xyz.model') as m1:
+        m2 = package.shared_memory('data', 'xyz.model')
+        assert m1.name == m2.name
+        assert bytes(m1.buf) == bytes(m2.buf) == data
+        m2.close()
+        shared.open_segment(m1.name).close()
+
+    with pytest.raises(FileNotFoundError):
+        shared.open_segment(m1.name)
+
+    # users that exit without close() do not keep segments alive
+    process = multiprocessing.Process(target=attach_and_exit,
+                                      args=(package.path, ['data', 'xyz.model']))
+    process.start()
+    process.join()
+    with package.shared_memory('data', 'xyz.model') as m1:
+        pass
+    with pytest.raises(FileNotFoundError):
+        shared.open_segment(m1.name)
+
+    process = multiprocessing.Process(target=attach_and_exit,
+                                      args=(package.path, ['data', 'xyz.model']))
+    process.start()
+    process.join()
+    assert shared.collect() == 1
+    with pytest.raises(FileNotFoundError):
+        shared.open_segment(m1.name)
+
+
+def attach_and_exit(path, path_parts):
+    Package(path).shared_memory(*path_parts)
+    os._exit(0)
+
+
+def test_pool_registry(tmp_path, sample_package_path, monkeypatch):
+    archive = Recipe(sample_package_path).build(tmp_path)
+    pool_path = os.path.join(tmp_path, 'pool')
+    pool = Pool('test', '1.0.0', pool_path)
+    ident = Package(path=pool.install(Archive(archive.path))).ident
+
+    loaded = []
+    json_load = util.json_load
+    def spy(path):
+        loaded.append(os.path.basename(path))
+        return json_load(path)
+    monkeypatch.setattr(util, 'json_load', spy)
+
+    pool = Pool('test', '1.0.0', pool_path)
+    assert [p.ident for p in pool.find()] == [ident]
+    assert loaded == ['packages.json']
+
+    # meta.json is only parsed on access
+    package = pool.find()[0]
+    assert package.manifest
+    assert loaded == ['packages.json', 'meta.json']
+
+    pool.remove(package)
+    assert Pool('test', '1.0.0', pool_path).find() == []
+
+
+def test_package_split_manifest(tmp_path, sample_package_path):
+    archive = Archive(Recipe(sample_package_path).build(tmp_path).path)
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    path = pool.install(archive)
+
+    meta = util.json_load(os.path.join(path, 'meta.json'))
+    assert 'manifest' not in meta
+    assert meta['files'] == len(archive.manifest)
+    assert meta['size'] == sum(e['size'] for e in archive.manifest)
+
+    package = Package(path=path)
+    assert package._manifest is None
+    assert package.has_file('data', 'xyz.json')
+    assert package.manifest == archive.manifest
+
+    # packages installed by older versions keep the manifest in meta.json
+    meta['manifest'] = archive.manifest
+    with io.open(os.path.join(path, 'meta.json'), 'wb') as f:
+        f.write(util.json_dump(meta))
+    os.remove(os.path.join(path, 'manifest.json'))
+    package = Package(path=path)
+    assert package.manifest == archive.manifest
+    with package.open(['data', 'xyz.json']) as f:
+        assert json.load(f) == {'test': True}
+
+
+def test_package_lazy_install_threads(tmp_path):
+    package_path = os.path.join(tmp_path, 'package')
+    os.makedirs(os.path.join(package_path, 'data'))
+    data = os.urandom(1024 * 1024)
+    with io.open(os.path.join(package_path, 'data', 'a.bin'), 'wb') as f:
+        f.write(data)
+    with io.open(os.path.join(package_path, 'package.json'), 'wb') as f:
+        f.write(util.json_dump({'name': 'lazy', 'version': '1.0.0',
+                                'include': [['data', '*']]}))
+
+    archive = Recipe(package_path).build(tmp_path)
+    pool = Pool('test', '1.0.0', os.path.join(tmp_path, 'pool'))
+    path = pool.install(Archive(archive.path), lazy=True)
+
+    # separate instances do not share a lock
+    errors = []
+    def work():
+        try:
+            with io.open(Package(path).file_path('data', 'a.bin'), 'rb') as f:
+                assert f.read() == data
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(os.path.join(path, 'data')) == ['a.bin']
+
+
+def test_pool_registry_same_mtime(tmp_path, sample_package_path, monkeypatch):
+    # file systems with whole second mtimes
+    mtime = util.mtime
+    monkeypatch.setattr(util, 'mtime', lambda path: mtime(path) and mtime(path) // 10 ** 9)
+
+    archive = Recipe(sample_package_path).build(tmp_path)
+    pool_path = os.path.join(tmp_path, 'pool')
+    pool = Pool('test', '1.0.0', pool_path)
+    pool.find()
+
+    ident = Package(path=pool.install(Archive(archive.path))).ident
+    assert [p.ident for p in pool.find()] == [ident]
+    assert [p.ident for p in Pool('test', '1.0.0', pool_path).find()] == [ident]
+
+    pool.remove(pool.find()[0])
+    assert pool.find() == []
+    assert Pool('test', '1.0.0', pool_path).find() == []
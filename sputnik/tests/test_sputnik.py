@@ -1,8 +1,12 @@
 import os
+import io
+import sys
 
 import pytest
 
-from .. import install, build, remove, search, find, upload, update, files, purge
+from .. import install, build, remove, search, find, upload, update, files, verify, purge, package
+from .. import util
+from ..pool import Pool
 
 
 def test_build(sample_package_path):
@@ -60,3 +64,79 @@ def test_purge(sample_package_path, tmp_path):
     purge('test', '1.0.0', data_path=tmp_path)
 
     assert len(find('test', '1.0.0', data_path=tmp_path)) == 0
+
+
+def test_install_from_stdin(sample_package_path, tmp_path, monkeypatch):
+    archive = build(sample_package_path)
+
+    class Stdin(object):
+        buffer = io.open(archive.path, 'rb')
+
+    monkeypatch.setattr(sys, 'stdin', Stdin())
+    package = install(None, None, '-', data_path=tmp_path)
+    assert os.path.isdir(package.path)
+    assert package.ident == archive.ident
+    assert package.has_file('data', 'xyz.json')
+    assert os.path.isfile(package.file_path('data', 'xyz.json'))
+
+
+def test_verify(sample_package_path, tmp_path, monkeypatch):
+    archive = build(sample_package_path)
+    package = install('test', '1.0.0', archive.path, data_path=tmp_path)
+    mtime = util.mtime(tmp_path)
+    assert verify('test', '1.0.0', data_path=tmp_path) == {package.ident: []}
+    assert util.mtime(tmp_path) == mtime
+
+    hashed = []
+    file_checksum = util.file_checksum
+    def spy(path, name, chunk_size=None):
+        hashed.append(path)
+        return file_checksum(path, name, chunk_size)
+    monkeypatch.setattr(util, 'file_checksum', spy)
+
+    assert verify('test', '1.0.0', fast=True, data_path=tmp_path) == {package.ident: []}
+    assert hashed == []
+
+    # same size, different content
+    path = package.file_path('data', 'xyz.json')
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    os.remove(path)
+    with io.open(path, 'wb') as f:
+        f.write(data.upper())
+
+    res = verify('test', '1.0.0', fast=True, data_path=tmp_path)
+    assert res == {package.ident: [os.path.join('data', 'xyz.json')]}
+    assert hashed == [path]
+
+
+def test_package_memoized(sample_package_path, sample_package_variant, tmp_path):
+    install('test', '1.0.0', build(sample_package_path).path, data_path=tmp_path)
+
+    pkg = package('test', '1.0.0', 'test', data_path=tmp_path)
+    assert pkg.version == '1.0.0'
+    assert package('test', '1.0.0', 'test', data_path=tmp_path) is pkg
+
+    package_path = sample_package_variant({'version': '2.0.0'})
+    archive = build(package_path, os.path.join(tmp_path, 'build'))
+
+    # installs from other pool instances invalidate the cached one
+    install('test', '1.0.0', archive.path, data_path=tmp_path)
+    assert package('test', '1.0.0', 'test', data_path=tmp_path).version == '2.0.0'
+
+
+def test_pool_reload_consistent(sample_package_path, tmp_path, monkeypatch):
+    pool = Pool('test', '1.0.0', tmp_path)
+    pool.install(build(sample_package_path))
+
+    # other threads read the shared instance while it reloads
+    seen = []
+    packages = pool.packages
+    def interleaved(refresh=None):
+        for package in packages(refresh):
+            seen.append((len(pool.find()), pool.get('test>=1.0.0').version))
+            yield package
+    monkeypatch.setattr(pool, 'packages', interleaved)
+
+    pool.load()
+    assert seen == [(1, '1.0.0')]
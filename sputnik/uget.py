@@ -188,9 +188,45 @@ def read_request(session, url, offset=0, console=None,
     return response
 
 
+def read_range(session, url, offset, length, write_func=None):
+    request = GetRequest(url)
+    request.add_header('Range', "bytes=%s-%s" % (offset, offset + length - 1))
+
+    try:
+        response = session.open(request)
+    except HTTPError as e:
+        if e.code == 416:  # Requested Range Not Satisfiable
+            raise InvalidOffsetException
+
+        raise UnsupportedHTTPCodeException(e.code)
+
+    # servers may ignore ranges and answer with 200
+    if response.code != 206:
+        raise UnsupportedHTTPCodeException(response.code)
+
+    range_start, range_end, _ = get_content_range(response)
+    assert range_start == offset
+    assert range_end == offset + length - 1
+
+    bytes_read = 0
+    while True:
+        chunk = response.read(default.CHUNK_SIZE)
+        if not chunk:
+            break
+
+        bytes_read += len(chunk)
+
+        if write_func:
+            write_func(chunk)
+
+    response.close()
+    assert bytes_read == length
+    return response
+
+
 def download(session, url, path=".",
              checksum=None, checksum_header=None,
-             console=None):
+             console=None, chunk_func=None):
 
     if os.path.isdir(path):
         path = os.path.join(path, url.rsplit('/', 1)[1])
@@ -200,15 +236,20 @@ def download(session, url, path=".",
         size = f.tell()
 
         # update checksum of partially downloaded file
-        if checksum:
+        if checksum or chunk_func:
             f.seek(0, os.SEEK_SET)
             for chunk in iter(lambda: f.read(default.CHUNK_SIZE), b""):
-                checksum.update(chunk)
+                if checksum:
+                    checksum.update(chunk)
+                if chunk_func:
+                    chunk_func(chunk)
 
         def write(chunk):
             if checksum:
                 checksum.update(chunk)
             f.write(chunk)
+            if chunk_func:
+                chunk_func(chunk)
 
         # TODO add headers
         try:
@@ -5,16 +5,25 @@ import os
 import re
 import platform
 import sys
+import errno
+import bisect
+import hashlib
 
 import semver
+try:
+    from functools import lru_cache
+except ImportError:  # python 2
+    lru_cache = None
 
 from .about import __version__
+from . import default
 
 
 class InvalidPathPartsException(Exception): pass
 class InvalidAppNameException(Exception): pass
 class InvalidConstraintException(Exception): pass
 class UnknownAppNameException(Exception): pass
+class UnknownChecksumException(Exception): pass
 
 
 def default_data_path(app_name):
@@ -36,17 +45,123 @@ def split_package_string(string):
     return [string[:m.start()], string[m.start():].strip()]
 
 
+# caches results of a function of one argument
+def memoize(maxsize):
+    if lru_cache:
+        return lru_cache(maxsize)
+
+    def decorator(func):
+        cache = {}
+        def wrapper(arg):
+            if arg not in cache:
+                if len(cache) >= maxsize:
+                    cache.clear()
+                cache[arg] = func(arg)
+            return cache[arg]
+        return wrapper
+    return decorator
+
+
+try:
+    _parse_version = semver.Version.parse
+except AttributeError:  # semver < 3
+    _parse_version = semver.VersionInfo.parse
+
+
+# tuples that order like semver.compare: releases after their
+# prereleases, numeric prerelease parts before alphanumeric ones
+@memoize(default.VERSION_CACHE_SIZE)
+def parse_version(version):
+    v = _parse_version(version)
+    if not v.prerelease:
+        return (v.major, v.minor, v.patch, (1,))
+
+    parts = tuple(p.isdigit() and (0, int(p), '') or (1, 0, p)
+                  for p in v.prerelease.split('.'))
+    return (v.major, v.minor, v.patch, (0, parts))
+
+
+def parse_constraints(constraint_string):
+    constraints = [c.strip() for c in (constraint_string or '').split(',') if c.strip()]
+
+    for c in constraints:
+        if not re.match(r'(>=|<=|==|!=|>|<)\d+(\.\d+)*', c):
+            raise InvalidConstraintException('invalid constraint: %s' % c)
+    return constraints
+
+
+class Constraint(object):
+    # parsed constraint string, evaluates like semver.match
+    results = {'>': (1,), '<': (-1,), '==': (0,), '!=': (-1, 1),
+               '>=': (0, 1), '<=': (-1, 0)}
+
+    def __init__(self, constraint_string):
+        self.clauses = []
+        for c in parse_constraints(constraint_string):
+            m = re.match(r'(>=|<=|==|!=|>|<)(.*)$', c)
+            if not m:
+                raise ValueError('invalid constraint operator: %s' % c)
+            self.clauses.append((m.group(1), parse_version(m.group(2))))
+
+    def match(self, version):
+        key = parse_version(version)
+        for op, other in self.clauses:
+            if (key > other) - (key < other) not in self.results[op]:
+                return False
+        return True
+
+    # index range of matching versions within keys sorted by version,
+    # None if the constraint cannot be answered by bisection
+    def range(self, keys):
+        lo, hi = 0, len(keys)
+        for op, key in self.clauses:
+            if op in ('>=', '=='):
+                lo = max(lo, bisect.bisect_left(keys, key))
+            elif op == '>':
+                lo = max(lo, bisect.bisect_right(keys, key))
+            if op in ('<=', '=='):
+                hi = min(hi, bisect.bisect_right(keys, key))
+            elif op == '<':
+                hi = min(hi, bisect.bisect_left(keys, key))
+            elif op == '!=':
+                return None
+        return lo, max(lo, hi)
+
+
+compile_constraint = memoize(default.CONSTRAINT_CACHE_SIZE)(Constraint)
+
+
 def constraint_match(constraint_string, version):
     if not constraint_string:
         return True
+    return compile_constraint(constraint_string).match(version)
 
-    constraints = [c.strip() for c in constraint_string.split(',') if c.strip()]
 
-    for c in constraints:
-        if not re.match(r'[><=][=]?\d+(\.\d+)*', c):
-            raise InvalidConstraintException('invalid constraint: %s' % c)
+def constraint_range(constraint_string, keys):
+    return compile_constraint(constraint_string or '').range(keys)
+
+
+def new_checksum(name):
+    # xxhash is optional and not part of hashlib
+    if name.startswith('xxh'):
+        try:
+            import xxhash
+            return getattr(xxhash, name)()
+        except (ImportError, AttributeError):
+            raise UnknownChecksumException('unsupported checksum: %s' % name)
+
+    try:
+        return hashlib.new(name)
+    except ValueError:
+        raise UnknownChecksumException('unsupported checksum: %s' % name)
 
-    return all(semver.match(version, c) for c in constraints)
+
+def file_checksum(path, name, chunk_size=None):
+    checksum = new_checksum(name)
+    with io.open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size or default.CHUNK_SIZE), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
 
 
 def get_path(*path_parts, **kwargs):
@@ -107,6 +222,57 @@ def json_load(path):
         return json.loads(f.read().decode('utf8'))
 
 
+# installed and cached packages keep the manifest apart from meta.json,
+# so reading package fields does not parse an entry per file
+def write_meta(path, meta):
+    meta = dict(meta)
+    files = []
+    if 'manifest' in meta:
+        manifest = meta.pop('manifest')
+        data = json.dumps(manifest, separators=(',', ':')).encode('utf8')
+
+        checksum = new_checksum(default.CHECKSUM)
+        checksum.update(data)
+        meta['manifest_checksum'] = (default.CHECKSUM, checksum.hexdigest())
+        meta['files'] = len(manifest)
+        meta['size'] = sum(entry['size'] for entry in manifest)
+        files.append((default.MANIFEST_FILENAME, data))
+
+    # manifest first, meta.json refers to it
+    files.append((default.META_FILENAME, json_dump(meta)))
+    for filename, content in files:
+        filename = os.path.join(path, filename)
+        makedirs(filename)
+        with io.open(filename + '.new', 'wb') as f:
+            f.write(content)
+        if os.path.exists(filename):  # windows does not replace files
+            os.remove(filename)
+        os.rename(filename + '.new', filename)
+
+
+def load_manifest(path, meta):
+    if 'manifest' in meta:  # written by older versions
+        return meta['manifest']
+
+    with io.open(os.path.join(path, default.MANIFEST_FILENAME), 'rb') as f:
+        data = f.read()
+
+    name, hexdigest = meta['manifest_checksum']
+    checksum = new_checksum(name)
+    checksum.update(data)
+    if checksum.hexdigest() != hexdigest:
+        raise Exception('checksum mismatch: %s' % default.MANIFEST_FILENAME)
+    return json.loads(data.decode('utf8'))
+
+
+# meta.json including the manifest
+def load_meta(path):
+    meta = json_load(os.path.join(path, default.META_FILENAME))
+    if 'manifest_checksum' in meta:
+        meta['manifest'] = load_manifest(path, meta)
+    return meta
+
+
 def json_print(obj):
     defaults = {'sort_keys': True, 'indent': 2, 'separators': (',', ': ')}
     sys.stdout.write(json.dumps(obj, **defaults) + '\n')
@@ -118,6 +284,80 @@ def makedirs(path):
         os.makedirs(path)
 
 
+def mtime(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return getattr(st, 'st_mtime_ns', st.st_mtime)
+
+
+# larger files are read and written in larger chunks
+def buffer_size(size):
+    size = min(size // 16, default.MAX_BUFFER_SIZE)
+    return max(size - size % default.CHUNK_SIZE, default.CHUNK_SIZE)
+
+
+# reserves disk space for a file of known size, so writes do not
+# fragment it and a full disk fails early
+def preallocate(f, size):
+    if not size or not hasattr(os, 'posix_fallocate'):
+        return
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except OSError:  # not supported by the file system
+        pass
+
+
+# copies length bytes at offset of src to the position of dst, within
+# the kernel if possible
+def copy_range(src, offset, dst, length, cb=None):
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    # sendfile writes to sockets only outside of linux
+    sendfile = getattr(os, 'sendfile', None) if sys.platform.startswith('linux') else None
+
+    copied = 0
+    while copied < length:
+        count = min(length - copied, default.MAX_BUFFER_SIZE)
+        n = None
+        try:
+            if copy_file_range:
+                n = copy_file_range(src.fileno(), dst.fileno(), count, offset + copied)
+            elif sendfile:
+                n = sendfile(dst.fileno(), src.fileno(), offset + copied, count)
+        except OSError as e:
+            # any error before the first byte means unsupported files
+            if copied and e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                          errno.EOPNOTSUPP, errno.EBADF):
+                raise
+            # fall back to plain reads and writes, dst position is unchanged
+            copy_file_range = sendfile = None
+
+        if n is None:
+            src.seek(offset + copied)
+            data = src.read(count)
+            written = 0
+            while written < len(data):
+                written += dst.write(data[written:])
+            n = len(data)
+
+        if not n:
+            raise Exception('unexpected end of archive')
+        copied += n
+
+        # callback for progress tracking
+        if cb:
+            cb(copied)
+
+
+def link_or_copy(src, dst):
+    makedirs(dst)
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):  # cross-device or no os.link
+        shutil.copy2(src, dst)
+
+
 def unquote(s):
     if (s[0] == s[-1]) and s.startswith(("'", '"')):
         return s[1:-1]